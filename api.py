@@ -0,0 +1,273 @@
+"""
+API JSON in sola lettura per il gestionale delle fatture, accanto all'app:
+
+    GET /students               studenti (id, nome, tariffa, note)
+    GET /lessons/AAAA-MM        lezioni del mese, con il nome dello studente
+    GET /totals/AAAA-MM         totali del mese per studente, con lo stato del pagamento
+    GET /payments/AAAA-MM       studenti che hanno pagato le lezioni del mese
+
+Autenticazione HTTP Basic con utente e password del tutor (tenants.json;
+con un solo tutor l'utente è ignorato). I dati vengono dallo Store e dagli
+indici in memoria (student_index, monthly_rollup), gli stessi dell'app.
+
+Ogni risposta ha un ETag ricavato dalla versione su disco delle tabelle che
+usa (Store.stamp): con If-None-Match uguale la risposta è 304, senza leggere
+né serializzare nulla; i corpi JSON già prodotti sono tenuti per ETag.
+
+    python api.py [cartella_app] [--host 127.0.0.1] [--port 8502]
+
+Nello stesso processo di Streamlit: TUTOR_API_PORT=8502 (e TUTOR_API_HOST),
+avviata in un thread in background al primo login.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from indexes import MonthlyRollup, StudentIndex
+from storage import KEYS, open_store
+from tenants import authenticate, load_tenants
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8502
+# Corpi JSON tenuti in memoria (per tenant e percorso)
+BODY_CACHE = 64
+
+log = logging.getLogger("tutor.api")
+
+
+# ───────────────────────────── RISORSE ─────────────────────────────────
+def _students(store, index):
+    df = store.load("students")
+    return [
+        {"id": sid, "name": str(name), "hourly_rate": float(rate), "note": str(note)}
+        for sid, name, rate, note in zip(df["id"], df["name"], df["hourly_rate"], df["note"])
+    ]
+
+
+def _lessons(store, index, year, month):
+    df = store.month("lessons", year, month).sort_values(["date", "id"])
+    return {"year": year, "month": month, "lessons": [
+        {"id": lid, "student_id": sid, "student": index.name(sid),
+         "date": d.date().isoformat(),
+         "duration_min": None if minutes is None or minutes != minutes else int(minutes),
+         "amount": round(float(amount), 2)}
+        for lid, sid, d, minutes, amount in zip(
+            df["id"], df["student_id"], df["date"],
+            df["duration_min"].astype(object), df["amount"])
+    ]}
+
+
+def _paid(store, sid, year, month) -> bool:
+    return bool(store.labels("payments", KEYS["payments"], (sid, year, month)))
+
+
+def _totals(store, index, year, month):
+    rollup = store.derived("monthly_rollup", ("lessons", "summaries"), MonthlyRollup)
+    cells = rollup.students(year, month)
+    lessons, summaries = rollup.month_totals(year, month)
+    rows = [
+        {"student_id": sid, "student": index.name(sid),
+         "lessons": int(c["lessons"]), "minutes": int(c["minutes"]),
+         "lesson_amount": round(c["lesson_amount"], 2),
+         "summaries": int(c["summaries"]), "summary_amount": round(c["summary_amount"], 2),
+         "total": round(c["lesson_amount"] + c["summary_amount"], 2),
+         "paid": _paid(store, sid, year, month)}
+        for sid, c in cells.items()
+    ]
+    rows.sort(key=lambda r: r["student"].lower())
+    return {"year": year, "month": month,
+            "lesson_amount": round(lessons, 2), "summary_amount": round(summaries, 2),
+            "total": round(lessons + summaries, 2), "students": rows}
+
+
+def _payments(store, index, year, month):
+    df = store.load("payments")
+    paid = df[(df["year"] == year) & (df["month"] == month)]
+    return {"year": year, "month": month, "paid": sorted(
+        ({"student_id": sid, "student": index.name(sid)} for sid in paid["student_id"]),
+        key=lambda r: r["student"].lower(),
+    )}
+
+
+# nome -> (tabelle da cui dipende, funzione, vuole AAAA-MM)
+ROUTES = {
+    "students": (("students",), _students, False),
+    "lessons":  (("students", "lessons"), _lessons, True),
+    "totals":   (("students", "lessons", "summaries", "payments"), _totals, True),
+    "payments": (("students", "payments"), _payments, True),
+}
+
+MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _route(path: str):
+    """(nome risorsa, argomenti) dal percorso; ApiError se non valido."""
+    parts = [p for p in path.split("?")[0].split("/") if p]
+    if not parts or parts[0] not in ROUTES:
+        raise ApiError(404, "risorsa inesistente")
+    name, (_, _, monthly) = parts[0], ROUTES[parts[0]]
+    if not monthly:
+        if len(parts) != 1:
+            raise ApiError(404, "risorsa inesistente")
+        return name, ()
+    match = MONTH.match(parts[1]) if len(parts) == 2 else None
+    if match is None or not 1 <= int(match[2]) <= 12:
+        raise ApiError(400, f"usa /{name}/AAAA-MM")
+    return name, (int(match[1]), int(match[2]))
+
+
+# ───────────────────────────── SERVER ──────────────────────────────────
+class Handler(BaseHTTPRequestHandler):
+    server_version = "TutorAPI/1"
+
+    def _tenant(self):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Basic "):
+            try:
+                user, _, password = base64.b64decode(auth[6:]).decode("utf-8").partition(":")
+            except (ValueError, UnicodeDecodeError):
+                return None
+            return authenticate(self.server.tenants, user, password)
+        return None
+
+    def _send(self, status: int, body: bytes = b"", etag: str = None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "private, no-cache")
+        if status == 401:
+            self.send_header("WWW-Authenticate", 'Basic realm="tutor"')
+        if body:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, message: str):
+        self._send(status, json.dumps({"error": message}, ensure_ascii=False).encode("utf-8"))
+
+    def do_GET(self):
+        tenant = self._tenant()
+        if tenant is None:
+            return self._error(401, "credenziali mancanti o errate")
+        try:
+            name, args = _route(self.path)
+        except ApiError as exc:
+            return self._error(exc.status, str(exc))
+
+        tables, build, _ = ROUTES[name]
+        store = open_store(self.server.tenants[tenant]["root"])
+
+        def etag():
+            # la versione dei dati si legge con qualche stat(): niente caricamenti
+            raw = f"{tenant}|{name}|{args}|{store.stamp(*tables)}"
+            return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+        tag = etag()
+        if tag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            return self._send(304, etag=tag)
+
+        body = self.server.cached(tag)
+        if body is None:
+            index = store.derived("student_index", ("students",), StudentIndex)
+            body = json.dumps(build(store, index, *args), ensure_ascii=False).encode("utf-8")
+            # il primo caricamento può riscrivere una tabella (migrazioni dello Store):
+            # l'ETag deve corrispondere ai dati serviti
+            tag = etag()
+            self.server.remember(tag, body)
+        self._send(200, body, tag)
+
+    do_HEAD = do_GET
+
+    def log_message(self, fmt, *args):
+        log.debug("%s " + fmt, self.address_string(), *args)
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tenants: dict):
+        super().__init__(address, Handler)
+        self.tenants = tenants
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, etag: str):
+        with self._lock:
+            body = self._bodies.get(etag)
+            if body is not None:
+                self._bodies.move_to_end(etag)
+            return body
+
+    def remember(self, etag: str, body: bytes):
+        with self._lock:
+            self._bodies[etag] = body
+            while len(self._bodies) > BODY_CACHE:
+                self._bodies.popitem(last=False)
+
+
+_server = None
+_server_lock = threading.Lock()
+# errore dell'ultimo avvio da start_from_env (es. porta occupata): non si riprova
+_start_error = None
+
+
+def serve_in_background(tenants: dict, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """Avvia l'API in un thread daemon, una sola volta per processo."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ApiServer((host, port), tenants)
+            threading.Thread(target=_server.serve_forever, name="tutor-api", daemon=True).start()
+            log.info("API su http://%s:%d", *_server.server_address[:2])
+        return _server
+
+
+def start_from_env(tenants: dict):
+    """
+    serve_in_background() se è impostata TUTOR_API_PORT, altrimenti niente.
+    Se la porta non si può usare (es. api.py o un altro processo Streamlit
+    già in ascolto) lo segnala una volta sola e l'app prosegue senza API.
+    """
+    global _start_error
+    port = os.environ.get("TUTOR_API_PORT")
+    if not port or _start_error is not None:
+        return None
+    host = os.environ.get("TUTOR_API_HOST", DEFAULT_HOST)
+    try:
+        return serve_in_background(tenants, host, int(port))
+    except OSError as exc:
+        _start_error = exc
+        log.warning("API non avviata su %s:%s: %s", host, port, exc)
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("app_dir", nargs="?", type=Path, default=Path(__file__).parent,
+                        help="cartella di app.py (tenants.json o dati del tutor unico)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    server = ApiServer((args.host, args.port), load_tenants(args.app_dir))
+    log.info("API su http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
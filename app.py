@@ -1,34 +1,82 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
+from pathlib import Path
+import metrics
+from tenants import authenticate, is_multi, load_tenants
+
+APP_DIR = Path(__file__).parent
+TENANTS = load_tenants(APP_DIR)
 
-# 🔐 LOGIN SEMPLICE (max 6 caratteri)
+# 🔐 LOGIN SEMPLICE; con più tutor anche il nome utente (le password di
+# tenants.json possono avere qualunque lunghezza)
 def check_password():
     def password_entered():
-        if st.session_state["password"] == "180217":
+        tenant = authenticate(TENANTS, st.session_state.get("username", ""), st.session_state["password"])
+        if tenant is not None:
             st.session_state["password_correct"] = True
+            st.session_state["tenant"] = tenant
             del st.session_state["password"]
         else:
             st.session_state["password_correct"] = False
 
+    if st.session_state.get("password_correct") and st.session_state.get("tenant") in TENANTS:
+        return
+    if is_multi(TENANTS):
+        st.text_input("👤 Utente", key="username")
     if "password_correct" not in st.session_state:
-        st.text_input("🔐 Inserisci la password per accedere:", type="password", max_chars=6, on_change=password_entered, key="password")
+        st.text_input("🔐 Inserisci la password per accedere:", type="password", on_change=password_entered, key="password")
         st.stop()
-    elif not st.session_state["password_correct"]:
-        st.text_input("❌ Password errata, riprova:", type="password", max_chars=6, on_change=password_entered, key="password")
+    else:
+        st.text_input("❌ Password errata, riprova:", type="password", on_change=password_entered, key="password")
         st.warning("Accesso negato.")
         st.stop()
 
 check_password()
+TENANT = TENANTS[st.session_state["tenant"]]
+metrics.start_run(tenant=st.session_state["tenant"])
 
+import os
 import pandas as pd
 import uuid
 from datetime import date
-from pathlib import Path
-from fpdf import FPDF
-import base64
+from storage import KEYS, StaleDataError, open_store
+from jobs import ACTIVE, FAILED, open_runner
+from indexes import Analytics, MonthlyRollup, SearchIndex, StudentIndex, daily_view
+from invoices import invoice_pdf, write_invoice_zip
+from contextlib import contextmanager
+from functools import partial, wraps
+from math import ceil
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def image_data_uri(img_path: str, width_px: int = None, mtime_ns: int = 0) -> str:
+    """
+    Data URI dell'immagine, calcolato una volta per processo (mtime_ns
+    invalida la cache se il file cambia). Con width_px e Pillow installato
+    l'immagine viene ridotta a quella larghezza e ricompressa.
+    """
+    import base64
+    import io
 
-def draw_home_background(img_path: str, width_px: int = 700, opacity: float = 0.05):
     with open(img_path, "rb") as f:
-        data = base64.b64encode(f.read()).decode()
+        raw = f.read()
+    if width_px:
+        try:
+            from PIL import Image
+        except ImportError:
+            pass  # Pillow opzionale: si usa il file originale
+        else:
+            img = Image.open(io.BytesIO(raw))
+            if img.width > width_px:
+                img = img.convert("RGB")
+                img.thumbnail((width_px, img.height))
+                buf = io.BytesIO()
+                img.save(buf, format="JPEG", quality=80, optimize=True, progressive=True)
+                raw = buf.getvalue()
+    return "data:image/jpeg;base64," + base64.b64encode(raw).decode()
+
+def draw_home_background(img_path: str, width_px: int = 700, opacity: float = 0.05):
+    path = APP_DIR / img_path
+    data = image_data_uri(str(path), width_px, path.stat().st_mtime_ns)
     st.markdown(
         f"""
         <style>
@@ -46,115 +94,169 @@ def draw_home_background(img_path: str, width_px: int = 700, opacity: float = 0.
             z-index: 1;
           }}
         </style>
-        <img src="data:image/jpeg;base64,{data}" class="bg-home" />
+        <img src="{data}" class="bg-home" />
         """,
         unsafe_allow_html=True,
     )
 
-INVOICE_BASE_URL = (
+INVOICE_BASE_URL = TENANT.get("invoice_url", (
     "https://asit.studiodigitale.cloud/wt00014499/login.sto"
     "?Login_Service=https%3A%2F%2Fasit.studiodigitale.cloud%2Fwt00014499%2Findex.sto"
     "&StwTokenSel=1123321717211031&utentebak=|wt00014499"
-)
+))
 
 st.set_page_config(page_title="Tutor Manager", layout="centered")
-APP_DIR = Path(__file__).parent
+# dati (e cache) del tutor che ha fatto login, caricati al primo accesso
+store = open_store(TENANT["root"])
+# lavori lunghi (ZIP, registro) in background, condivisi fra le sessioni
+runner = open_runner(TENANT["root"])
+# API JSON in sola lettura (con TUTOR_API_PORT), una per processo;
+# senza la variabile il modulo non viene nemmeno importato
+if os.environ.get("TUTOR_API_PORT"):
+    import api
+    api.start_from_env(TENANTS)
 
-FILES = {
-    "students":  APP_DIR / "students.csv",
-    "lessons":   APP_DIR / "lessons.csv",
-    "summaries": APP_DIR / "summaries.csv",
-    "payments":  APP_DIR / "payments.csv",
-    "day_checks": APP_DIR / "day_checks.csv",
-}
+def new_id():
+    return uuid.uuid4().hex[:8]
 
-COLUMNS = {
-    "students":  ["id", "name", "hourly_rate", "note"],
-    "lessons":   ["id", "student_id", "date", "duration_min", "amount"],
-    "summaries": ["id", "student_id", "date", "release_date", "title", "price", "author", "paid"],
-    "payments":  ["student_id", "year", "month"],
-    "day_checks": ["date", "checked"],
-}
+def search_index():
+    # indice per prefisso su titoli e nomi, condiviso dalle due ricerche
+    return store.derived("search_index", ("students", "summaries"), SearchIndex)
 
-def load_csv(path: Path, cols: list):
-    if path.exists():
-        df = pd.read_csv(path)
-        df = df[[c for c in df.columns if c in cols]]
-        for col in cols:
-            if col not in df.columns:
-                df[col] = pd.NA
-        return df[cols]
-    return pd.DataFrame(columns=cols)
+def student_label(sid):
+    return student_index.label(sid)
+
+def student_name(sid):
+    return student_index.name(sid)
+
+def lessons_of_month(year, month):
+    # mese chiuso: solo la sua partizione d'archivio (sola lettura)
+    return store.month("lessons", year, month)
+
+def month_closed(table, d):
+    return store.archive.is_closed(table, d.year, d.month)
+
+def invoice_pdf_for(sid, name, year, month, total):
+    les = lessons_of_month(year, month)
+    rows = les[les["student_id"] == sid].to_dict("records")
+    with metrics.phase("pdf"):
+        return invoice_pdf(sid, name, rows, year, month, total)
+
+# Funzioni dei lavori in background: girano nel JobRunner, fuori dallo
+# script, quindi usano solo lo store e scrivono il risultato in `out`.
+def invoices_zip_job(out, store, year, month, combined, progress=None):
+    les = store.month("lessons", year, month)
+    index = store.derived("student_index", ("students",), StudentIndex)
+    jobs = [
+        (sid, index.name(sid), grp.to_dict("records"), year, month, grp["amount"].sum())
+        for sid, grp in les.groupby("student_id", observed=True)
+    ]
+    jobs.sort(key=lambda job: job[1].lower())
+    write_invoice_zip(out, jobs, combined=combined, progress=progress)
 
-def save_csv(df: pd.DataFrame, path: Path):
-    df.to_csv(path, index=False)
+def ledger_job(out, store, start, end, fmt, progress=None):
+    import ledger
 
-def new_id():
-    return uuid.uuid4().hex[:8]
+    ledger.export(store, start, end, fmt, out, progress=progress)
 
-def student_label(sid):
-    row = students[students["id"] == sid]
-    if row.empty:
-        return sid
-    r = row.iloc[0]
-    return f"{r['name']} — {r['hourly_rate']:.2f} EUR/h"
+# Le righe delle liste sono "fragment": un toggle riesegue solo la propria riga
+# (scope="fragment") invece dell'intero script.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
 
-def rerun():
+def fragment(f):
+    # un rerun del solo fragment ha il proprio record di metriche
+    @wraps(f)
+    def measured(*args, **kwargs):
+        with metrics.run(tenant=st.session_state["tenant"], fragment=f.__name__):
+            return f(*args, **kwargs)
+    return _fragment(measured)
+
+def rerun(scope="app"):
     try:
+        st.rerun(scope=scope)
+    except (TypeError, StreamlitAPIException):
+        # versione senza scope, o click gestito durante un rerun completo
         st.rerun()
     except AttributeError:
         st.experimental_rerun()
 
-def toggle_paid(sid, year, month):
-    mask = (payments.student_id == sid) & (payments.year == year) & (payments.month == month)
-    if payments.loc[mask].empty:
-        payments.loc[len(payments)] = {"student_id": sid, "year": year, "month": month}
+@contextmanager
+def fresh_data():
+    """
+    Attorno alle scritture: se un altro processo ha modificato la tabella
+    dopo la lettura, niente sovrascrittura, si ricarica la pagina.
+    """
+    try:
+        yield
+    except StaleDataError:
+        st.toast("Dati modificati da un'altra sessione: pagina aggiornata, ripeti l'operazione.")
+        rerun()
+
+PAGE_SIZES = (25, 50, 100, 200)
+
+def paginate(df, key, caption=""):
+    """
+    Controlli di paginazione per df: restituisce solo la fetta visibile,
+    così i widget vengono creati soltanto per le righe della pagina.
+    """
+    c1, c2, c3 = st.columns([2, 2, 3])
+    size  = c1.selectbox("Per pagina", PAGE_SIZES, index=1, key=f"{key}_size")
+    pages = max(1, ceil(len(df) / size))
+    # dopo un filtro la pagina salvata può non esistere più
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    page = c2.number_input("Pagina", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    c3.caption(f"{caption}pagina {page} di {pages}")
+    start = (page - 1) * size
+    return df.iloc[start:start + size]
+
+JOB_POLL_S = 1.0
+
+def job_panel(key, kind, labels, fn, *args, file_name, mime):
+    """
+    Lavoro in background con chiave `key`: pulsante di avvio, avanzamento
+    (riletto ogni JOB_POLL_S finché è in corso, senza rieseguire la pagina)
+    e download del risultato, disponibile anche nei rerun successivi.
+    labels = (testo del pulsante di avvio, testo del download).
+    """
+    polling = (runner.get(key) or {}).get("status") in ACTIVE
+
+    def panel():
+        job = runner.get(key)
+        path = runner.result_path(job)
+        if job is not None and job["status"] in ACTIVE:
+            text = f"{job['done']}/{job['total']}" if job["total"] else "In coda…"
+            st.progress(job["done"] / job["total"] if job["total"] else 0.0, text=text)
+        elif path is not None:
+            if polling:
+                rerun()  # finito: si torna alla pagina senza polling
+            st.download_button(labels[1], data=path.read_bytes, file_name=file_name,
+                               mime=mime, key=f"get_{key}")
+        else:
+            if job is not None and job["status"] == FAILED:
+                st.error(f"Lavoro non riuscito ({job['error']}).")
+            if st.button(labels[0], key=f"start_{key}"):
+                runner.submit(key, kind, fn, *args)
+                rerun()
+
+    if polling and hasattr(st, "fragment"):
+        st.fragment(run_every=JOB_POLL_S)(panel)()
     else:
-        payments.drop(index=payments.loc[mask].index, inplace=True)
-    save_csv(payments, FILES["payments"])
-    rerun()
+        panel()
+
+def is_paid(sid, year, month):
+    # lookup sull'indice (student_id, year, month): niente scansione dei pagamenti
+    return bool(store.labels("payments", KEYS["payments"], (sid, year, month)))
+
+def toggle_paid(sid, year, month):
+    rows = store.labels("payments", KEYS["payments"], (sid, year, month))
+    with fresh_data():
+        if rows:
+            store.delete("payments", payments, rows)
+        else:
+            store.insert("payments", payments, {"student_id": sid, "year": year, "month": month})
+    rerun("fragment")
 
-import unicodedata
-
-def safe_text(text):
-    """
-    Rimuove caratteri non compatibili con 'latin-1'.
-    """
-    if not isinstance(text, str):
-        text = str(text)
-    return unicodedata.normalize("NFKD", text).encode("latin-1", "ignore").decode("latin-1")
-
-def generate_invoice_pdf(name, rows, year, month, total):
-    from fpdf import FPDF
-
-    pdf = FPDF(format="A4")
-    pdf.add_page()
-
-    # Usa un font standard compatibile
-    pdf.set_font("Helvetica", size=14)
-
-    # Titolo
-    title = f"Report lezioni - {name} [{month:02d}/{year}]"
-    pdf.cell(0, 10, txt=safe_text(title), ln=True, align="C")
-    pdf.ln(5)
-
-    pdf.set_font("Helvetica", size=12)
-
-    if not rows:
-        pdf.cell(0, 8, txt=safe_text("Nessuna lezione registrata."), ln=True)
-    else:
-        for r in rows:
-            data = safe_text(r.get("date", ""))
-            dur  = int(r.get("duration_min", 0))
-            amt  = float(r.get("amount", 0.0))
-            line = f"{data}   |   {dur} min   |   {amt:.2f} EUR"
-            pdf.cell(0, 8, txt=safe_text(line), ln=True)
-
-    pdf.ln(5)
-    pdf.set_font("Helvetica", style="B", size=12)
-    pdf.cell(0, 10, txt=safe_text(f"Totale mese: {total:.2f} EUR"), ln=True, align="R")
-
-    return pdf.output(dest="S").encode("latin-1")
 
 
 
@@ -164,60 +266,71 @@ def toggle_summary_author(sid):
     if not idx.empty:
         i = idx[0]
         curr = summaries.at[i, "author"]
-        summaries.at[i, "author"] = "P" if curr == "C" else "C"
-        save_csv(summaries, FILES["summaries"])
+        with fresh_data():
+            store.update("summaries", summaries, i, {"author": "P" if curr == "C" else "C"})
         rerun()
 
 
 def toggle_summary_paid(rid: str):
     """
-    Al click sul badge Pagato/Non pagato, inverte il valore nel CSV.
+    Al click sul badge Pagato/Non pagato, inverte il valore salvato.
     """
     # trova l’indice del riassunto con quell’id
     idx = summaries[summaries.id == rid].index
     if not idx.empty:
         i = idx[0]
         # inverte il valore True<->False
-        summaries.at[i, "paid"] = not summaries.at[i, "paid"]
-        save_csv(summaries, FILES["summaries"])
-        rerun()
-
-
-
-# ──────────────────────── LOAD DATA ───────────────────────────
-students  = load_csv(FILES["students"],  COLUMNS["students"])
-if "note" not in students.columns:
-    students["note"] = ""
-lessons   = load_csv(FILES["lessons"],   COLUMNS["lessons"])
-summaries = load_csv(FILES["summaries"], COLUMNS["summaries"])
-payments  = load_csv(FILES["payments"],  COLUMNS["payments"])
-# ── Carica e inizializza lo stato dei giorni checkati ──
-day_checks = load_csv(FILES["day_checks"], COLUMNS["day_checks"])
-# Assicuriamoci che la colonna checked sia di tipo booleano
-day_checks["checked"] = day_checks["checked"].fillna(False).astype(bool)
+        with fresh_data():
+            store.update("summaries", summaries, i, {"paid": not summaries.at[i, "paid"]})
+        rerun("fragment")
 
 
-# default author = 'C'
-summaries["author"] = summaries["author"].fillna("C")
-
-# assegna False a tutti i paid vuoti in summaries
-summaries["paid"] = summaries["paid"].fillna(False)
-
-#realese_date
-summaries["release_date"] = summaries.get("release_date", "")
 
+metrics.lap("avvio")
 
 # ────────────────────────── SIDEBAR ────────────────────────────
 page = st.sidebar.radio(
     "Menu",
-    ("Home", "Studenti", "Lezioni", "Riassunti", "Report Mensile")
+    ("Home", "Studenti", "Lezioni", "Riassunti", "Report Mensile", "Analisi")
 )
+if is_multi(TENANTS) and st.sidebar.button("Esci"):
+    for key in ("password_correct", "tenant"):
+        st.session_state.pop(key, None)
+    rerun()
+
+
+# ──────────────────────── LOAD DATA ───────────────────────────
+# Solo le tabelle usate dalla pagina scelta (la Home non ne legge nessuna).
+# La cancellazione a cascata di uno studente carica da sé le tabelle figlie.
+PAGE_TABLES = {
+    "Home":           (),
+    "Studenti":       ("students",),
+    "Lezioni":        ("students", "lessons", "day_checks"),
+    "Riassunti":      ("students", "summaries"),
+    "Report Mensile": ("students", "lessons", "summaries", "payments"),
+    "Analisi":        ("students", "lessons", "summaries", "payments"),
+}
+need = PAGE_TABLES[page]
+
+def table(name):
+    return store.load(name) if name in need else None
+
+students  = table("students")
+# indice id -> nome/tariffa, ricostruito solo quando cambiano gli studenti
+student_index = store.derived("student_index", ("students",), StudentIndex) if need else None
+lessons   = table("lessons")
+summaries = table("summaries")
+payments  = table("payments")
+# ── Stato dei giorni checkati ──
+# (tipi e valori di default di tutte le tabelle sono applicati da store.load)
+day_checks = table("day_checks")
+metrics.lap("dati")
 
 
 # ─────────────────────────── HOME ──────────────────────────────
 if page == "Home":
     st.title("Tutor Manager")
-    st.write("Benvenuta Chiara")
+    st.write(TENANT["welcome"])
     draw_home_background("foto.jpeg", width_px=580, opacity=0.30)
 
 
@@ -238,20 +351,22 @@ elif page == "Studenti":
         )
         note = st.text_area("Note", key="student_note")
         if st.form_submit_button("Aggiungi"):
-            students.loc[len(students)] = {
-                "id":       new_id(),
-                "name":     name,
-                "hourly_rate": rate,
-                "note":     note
-            }
-            save_csv(students, FILES["students"])
+            with fresh_data():
+                store.insert("students", students, {
+                    "id":       new_id(),
+                    "name":     name,
+                    "hourly_rate": rate,
+                    "note":     note
+                })
             st.success("Studente aggiunto!")
             rerun()
 
-    st.subheader("Elenco studenti")
-    # ── Stampa in ordine alfabetico per nome
-    for _, row in students.sort_values("name").iterrows():
-        sid       = row["id"]
+    @fragment
+    def student_row(label, sid):
+        # la riga può essere stata eliminata da questo stesso fragment
+        if label not in students.index or students.at[label, "id"] != sid:
+            return
+        row       = students.loc[label]
         note_text = row.get("note", "")
 
         # gestisco NA o stringa vuota
@@ -270,19 +385,14 @@ elif page == "Studenti":
             st.session_state[f"edit_note_{sid}"] = True
         # bottone elimina studente
         if c4.button("🗑", key=f"delstud_{sid}"):
-            lessons.drop(
-                index=lessons[lessons.student_id == sid].index, inplace=True
-            )
-            summaries.drop(
-                index=summaries[summaries.student_id == sid].index, inplace=True
-            )
-            students.drop(
-                index=students[students.id == sid].index, inplace=True
-            )
-            save_csv(lessons, FILES["lessons"])
-            save_csv(summaries, FILES["summaries"])
-            save_csv(students, FILES["students"])
-            rerun()
+            # le lezioni dei mesi chiusi non si cancellano: lo studente resta
+            if store.archived_children("students", sid):
+                st.error("Lo studente ha lezioni in mesi chiusi (archiviati): non si può eliminare.")
+            else:
+                # lezioni, riassunti e pagamenti dello studente insieme allo studente
+                with fresh_data():
+                    store.delete_cascade("students", students, label)
+                rerun("fragment")
 
         # ── Form di modifica nota, mostrato solo se edit_note_[sid] == True
         if st.session_state.get(f"edit_note_{sid}", False):
@@ -294,12 +404,27 @@ elif page == "Studenti":
                 key=f"note_input_{sid}"
             )
             if st.button("Salva nota", key=f"save_note_{sid}"):
-                idx = students[students.id == sid].index[0]
-                students.at[idx, "note"] = new_note
-                save_csv(students, FILES["students"])
+                with fresh_data():
+                    store.update("students", students, label, {"note": new_note})
                 st.session_state[f"edit_note_{sid}"] = False
                 st.success("Nota aggiornata!")
-                rerun()
+                rerun("fragment")
+
+    st.subheader("Elenco studenti")
+    as_table = st.toggle("Vista tabella (sola lettura)", key="students_table")
+    # ── Stampa in ordine alfabetico per nome
+    ordered = students.sort_values("name")
+    if as_table:
+        st.dataframe(
+            ordered[["name", "hourly_rate", "note"]].rename(
+                columns={"name": "Nome", "hourly_rate": "Tariffa (EUR/h)", "note": "Note"}
+            ),
+            hide_index=True,
+        )
+    else:
+        page_df = paginate(ordered, "students", caption=f"{len(ordered)} studenti · ")
+        for label, sid in page_df["id"].items():
+            student_row(label, sid)
 
 
 
@@ -314,7 +439,7 @@ elif page == "Lezioni":
     # ── FORM AGGIUNGI LEZIONE (4 spazi)
     with st.form(key="add_lesson"):
         # Creiamo la lista di ID ordinati per nome
-        sorted_ids = students.sort_values("name")["id"].tolist()
+        sorted_ids = student_index.sorted_ids()
         sid = st.selectbox(
             "Studente",
             sorted_ids,
@@ -331,21 +456,24 @@ elif page == "Lezioni":
         )
         
         if st.form_submit_button("Aggiungi lezione"):
-            rate   = students.loc[students.id == sid, "hourly_rate"].iloc[0]
-            amount = dur / 60 * rate
-            lessons.loc[len(lessons)] = {
-                "id": new_id(),
-                "student_id": sid,
-                "date": d.isoformat(),
-                "duration_min": dur,
-                "amount": amount,
-            }
-            save_csv(lessons, FILES["lessons"])
-            st.success("Lezione salvata!")
-            for key in ("lesson_date", "lesson_duration"):
-                if key in st.session_state:
-                    del st.session_state[key]
-            rerun()
+            if month_closed("lessons", d):
+                st.error("Il mese è chiuso (archiviato): non si possono aggiungere lezioni.")
+            else:
+                rate   = student_index.rate(sid)
+                amount = dur / 60 * rate
+                with fresh_data():
+                    store.insert("lessons", lessons, {
+                        "id": new_id(),
+                        "student_id": sid,
+                        "date": d.isoformat(),
+                        "duration_min": dur,
+                        "amount": amount,
+                    })
+                st.success("Lezione salvata!")
+                for key in ("lesson_date", "lesson_duration"):
+                    if key in st.session_state:
+                        del st.session_state[key]
+                rerun()
 
     # ── FILTRO MESE/ANNO ─────────────────────────────────────────────────────
     st.markdown("**Filtra per mese e anno**")
@@ -355,53 +483,54 @@ elif page == "Lezioni":
     month_sel = cm.selectbox("Mese", list(range(1, 13)), index=today.month - 1)
 
     # ── COSTRUISCO IL DATAFRAME df DOPO IL FILTRO ──────────────────────────
-    df = lessons.copy()
-    df["dt"] = pd.to_datetime(df["date"])
-    df = df[
-        (df["dt"].dt.year  == year_sel) &
-        (df["dt"].dt.month == month_sel)
-    ]
-
-    # ── DAY_CHECKS: carico lo stato salvato prima di usarlo ────────────────
-    day_checks = load_csv(FILES["day_checks"], COLUMNS["day_checks"])
-    day_checks["checked"] = day_checks["checked"].fillna(False).astype(bool)
+    df = lessons_of_month(year_sel, month_sel)
+    closed = store.archive.is_closed("lessons", year_sel, month_sel)
+
+    @fragment
+    def day_block(day, title, rows, closed=False):
+        # solo le lezioni del giorno ancora presenti (una può essere appena stata eliminata)
+        if not closed:
+            # stessa etichetta e stesso id: insert riusa le etichette liberate
+            rows = [r for r in rows if r[0] in lessons.index and lessons.at[r[0], "id"] == r[1]]
+        if not rows:
+            return
+        # stato del cerchio: lookup sull'indice per data, niente scansione
+        check_row = store.labels("day_checks", "date", day)
+        checked   = bool(day_checks.at[check_row[0], "checked"]) if check_row else False
+
+        # expander (chiuso di default)
+        with st.expander(f"📅  {title}", expanded=False):
+            # titolo + toggle
+            c0, c1 = st.columns([9, 1])
+            c0.markdown(f"**📅 {title}**")
+            circle = "🟢" if checked else "🔴"
+            if c1.button(circle, key=f"check_{day:%Y-%m-%d}"):
+                with fresh_data():
+                    if not check_row:
+                        store.insert("day_checks", day_checks, {"date": day, "checked": not checked})
+                    else:
+                        store.update("day_checks", day_checks, check_row[0], {"checked": not checked})
+                rerun("fragment")
+
+            # elenco lezioni di quel giorno
+            for label2, lid, name in rows:
+                cA, cB = st.columns([9, 1])
+                cA.write(name)
+                # le lezioni dei mesi archiviati non si cancellano
+                if not closed and cB.button("🗑", key=f"delless_{lid}"):
+                    with fresh_data():
+                        store.delete("lessons", lessons, [label2])
+                    rerun("fragment")
 
     # ── ORA POSSO USARE df ──────────────────────────────────────────────────
     if df.empty:
         st.info("Nessuna lezione per il mese scelto.")
     else:
         st.subheader("Vista giornaliera")
-        for day in sorted(df["date"].unique(), reverse=True):
-            # recupero lo stato del cerchio
-            row     = day_checks[day_checks["date"] == day]
-            checked = bool(row["checked"].iloc[0]) if not row.empty else False
-
-            # expander (chiuso di default)
-            with st.expander(f"📅  {pd.to_datetime(day).strftime('%d/%m/%Y')}", expanded=False):
-                # titolo + toggle
-                c0, c1 = st.columns([9, 1])
-                c0.markdown(f"**📅 {pd.to_datetime(day).strftime('%d/%m/%Y')}**")
-                circle = "🟢" if checked else "🔴"
-                if c1.button(circle, key=f"check_{day}"):
-                    if row.empty:
-                        day_checks.loc[len(day_checks)] = {"date": day, "checked": not checked}
-                    else:
-                        idx = row.index[0]
-                        day_checks.at[idx, "checked"] = not checked
-                    save_csv(day_checks, FILES["day_checks"])
-                    rerun()
-
-                # elenco lezioni di quel giorno
-                sub = df[df["date"] == day].sort_index()
-                for _, r2 in sub.iterrows():
-                    cA, cB = st.columns([9, 1])
-                    name   = student_label(r2["student_id"]).split(" — ")[0]
-                    cA.write(name)
-                    if cB.button("🗑", key=f"delless_{r2['id']}"):
-                        idx2 = lessons[lessons.id == r2["id"]].index
-                        lessons.drop(index=idx2, inplace=True)
-                        save_csv(lessons, FILES["lessons"])
-                        rerun()
+        if closed:
+            st.caption("Mese chiuso: lezioni in archivio, in sola lettura.")
+        for day, title, rows in daily_view(df, student_index):
+            day_block(day, title, rows, closed)
 
 
 
@@ -424,7 +553,7 @@ elif page == "Riassunti":
     search_s = st.text_input(
         "🔍 Cerca riassunti per studente o titolo",
         value="",
-        help="Digita parte del nome dello studente o del titolo"
+        help="Digita l'inizio di una o più parole del nome dello studente o del titolo"
     )
 
     # ── Totali per autore
@@ -440,7 +569,7 @@ elif page == "Riassunti":
 
     # ── Form per aggiungere riassunto
     with st.form(key="add_summary"):
-        sorted_ids = students.sort_values("name")["id"].tolist()
+        sorted_ids = student_index.sorted_ids()
         sid        = st.selectbox(
             "Studente",
             sorted_ids,
@@ -459,86 +588,103 @@ elif page == "Riassunti":
             key="sum_price"
         )
         if st.form_submit_button("Aggiungi riassunto"):
-            if new_name:
-                new_sid = new_id()
-                students.loc[len(students)] = {
-                    "id":       new_sid,
-                    "name":     new_name,
-                    "hourly_rate": 0.0,
-                    "note":     ""  # o qualunque default
-                }
-                save_csv(students, FILES["students"])
-                sid = new_sid
-            # aggiungo release_date
-            summaries.loc[len(summaries)] = {
-                "id":           new_id(),
-                "student_id":   sid,
-                "date":         d.isoformat(),
-                "release_date": release_date.isoformat(),
-                "title":        title,
-                "price":        price,
-                "author":       "C",
-                "paid":         False
-            }
-            save_csv(summaries, FILES["summaries"])
+            with fresh_data():
+                if new_name:
+                    new_sid = new_id()
+                    store.insert("students", students, {
+                        "id":       new_sid,
+                        "name":     new_name,
+                        "hourly_rate": 0.0,
+                        "note":     ""  # o qualunque default
+                    })
+                    sid = new_sid
+                # aggiungo release_date
+                store.insert("summaries", summaries, {
+                    "id":           new_id(),
+                    "student_id":   sid,
+                    "date":         d.isoformat(),
+                    "release_date": release_date.isoformat(),
+                    "title":        title,
+                    "price":        price,
+                    "author":       "C",
+                    "paid":         False
+                })
             st.success("Riassunto salvato!")
             rerun()
 
+    @fragment
+    def summary_row(label, rid):
+        if label not in summaries.index or summaries.at[label, "id"] != rid:
+            return
+        r = summaries.loc[label]
+        c1, c2, c3, c4, c5, c6, c7 = st.columns([3, 2, 2, 2, 1, 1, 1])
+
+        # Titolo e studente
+        stud_label = student_name(r["student_id"])
+        c1.write(f"{r['title']} ({stud_label})")
+
+        # Data originale formattata
+        c2.write(r["date"].strftime("%d/%m/%Y"))
+
+        # Data di rilascio (con placeholder se mancante)
+        rel_date = r["release_date"]
+        if pd.isna(rel_date):
+            c3.write("-")
+        else:
+            c3.write(rel_date.strftime("%d/%m/%Y"))
+
+        # Prezzo
+        c4.write(f"{r['price']:.2f} EUR")
+
+        # Toggle Author (C/P): cambia i totali per autore, serve il rerun completo
+        if c5.button(r["author"], key=f"auth_{r['id']}"):
+            toggle_summary_author(r["id"])
+
+        # Toggle Pagato/Non pagato: riesegue solo la riga
+        paid_label = "🟢" if r["paid"] else "🔴"
+        if c6.button(paid_label, key=f"paid_sum_{r['id']}"):
+            toggle_summary_paid(r["id"])
+
+        # Delete (anche questo cambia i totali)
+        if c7.button("🗑", key=f"delsum_{r['id']}"):
+            with fresh_data():
+                store.delete("summaries", summaries, [label])
+            rerun()
+
     # ── Elenco riassunti filtrato, con data formattata, toggle e delete
-        st.subheader("Elenco riassunti")
-    df = summaries.copy()
+    st.subheader("Elenco riassunti")
+    df = summaries
 
     # Applica ricerca su titolo o studente
     if search_s:
-        mask_name  = df["student_id"].map(student_label).str.lower().str.contains(search_s.lower())
-        mask_title = df["title"].str.lower().str.contains(search_s.lower())
-        df = df[mask_name | mask_title]
+        df = df[df["id"].isin(search_index().summaries(search_s))]
 
     if df.empty:
         st.info("Nessun riassunto corrisponde alla ricerca.")
     else:
         # ordina per data discendente
-        df["dt"] = pd.to_datetime(df["date"])
-        df = df.sort_values("dt", ascending=False)
-
-        # Ciclo principale sui riassunti
-        for _, r in df.iterrows():
-            c1, c2, c3, c4, c5, c6, c7 = st.columns([3, 2, 2, 2, 1, 1, 1])
-
-            # Titolo e studente
-            stud_label = student_label(r["student_id"]).split(" — ")[0]
-            c1.write(f"{r['title']} ({stud_label})")
-
-            # Data originale formattata
-            dt_obj = pd.to_datetime(r["date"])
-            c2.write(dt_obj.strftime("%d/%m/%Y"))
-
-            # Data di rilascio (con placeholder se mancante)
-            rel_date = r.get("release_date", "")
-            if pd.isna(rel_date) or rel_date == "":
-                c3.write("-")
-            else:
-                rel_obj = pd.to_datetime(rel_date)
-                c3.write(rel_obj.strftime("%d/%m/%Y"))
-
-            # Prezzo
-            c4.write(f"{r['price']:.2f} EUR")
-
-            # Toggle Author (C/P)
-            if c5.button(r["author"], key=f"auth_{r['id']}"):
-                toggle_summary_author(r["id"])
-
-            # Toggle Pagato/Non pagato
-            paid_label = "🟢" if r["paid"] else "🔴"
-            if c6.button(paid_label, key=f"paid_sum_{r['id']}"):
-                toggle_summary_paid(r["id"])
-
-            # Delete
-            if c7.button("🗑", key=f"delsum_{r['id']}"):
-                idx = summaries[summaries.id == r["id"]].index
-                summaries.drop(index=idx, inplace=True)
-                save_csv(summaries, FILES["summaries"])
-                rerun()
+        df = df.sort_values("date", ascending=False)
+        # totali sempre sull'intero insieme filtrato, non sulla sola pagina
+        caption = f"{len(df)} riassunti · {df['price'].sum():.2f} EUR · "
+
+        if st.toggle("Vista tabella (sola lettura)", key="summaries_table"):
+            st.caption(caption.rstrip(" ·"))
+            st.dataframe(
+                pd.DataFrame({
+                    "Titolo":   df["title"],
+                    "Studente": df["student_id"].map(student_name),
+                    "Data":     df["date"].dt.strftime("%d/%m/%Y"),
+                    "Rilascio": df["release_date"].dt.strftime("%d/%m/%Y").fillna("-"),
+                    "Prezzo":   df["price"],
+                    "Autore":   df["author"],
+                    "Pagato":   df["paid"],
+                }),
+                hide_index=True,
+            )
+        else:
+            # Ciclo principale sui riassunti (solo la pagina visibile)
+            for label, rid in paginate(df, "summaries", caption=caption)["id"].items():
+                summary_row(label, rid)
 
 
 
@@ -569,23 +715,16 @@ elif page == "Report Mensile":
         key="report_month"
     )
 
-    # ── Filtra dati
-    les_m = lessons[
-        (pd.to_datetime(lessons["date"]).dt.year  == year) &
-        (pd.to_datetime(lessons["date"]).dt.month == month)
-    ]
-    sum_m = summaries[
-        (pd.to_datetime(summaries["date"]).dt.year  == year) &
-        (pd.to_datetime(summaries["date"]).dt.month == month)
-    ]
+    # ── Totali del mese dal rollup (nessuna scansione dello storico)
+    rollup = store.derived("monthly_rollup", ("lessons", "summaries"), MonthlyRollup)
+    month_cells = rollup.students(year, month)
 
-    if les_m.empty and sum_m.empty:
+    if not month_cells:
         st.info("Nessun dato per il mese selezionato.")
         st.stop()
 
     # ── Totali globali
-    tot_less_glob  = les_m["amount"].sum()
-    tot_sum_glob   = sum_m["price"].sum()
+    tot_less_glob, tot_sum_glob = rollup.month_totals(year, month)
     tot_month_glob = tot_less_glob + tot_sum_glob
     st.markdown(
         f"<div style='border:1px solid #ddd; border-radius:6px; "
@@ -601,35 +740,44 @@ elif page == "Report Mensile":
     st.markdown(f"[📄 Vai alla fattura]({INVOICE_BASE_URL})", unsafe_allow_html=True)
     st.write("")
 
+    # ── Tutte le fatture del mese in un unico ZIP (lavoro in background)
+    if any(c["lessons"] for c in month_cells.values()):
+        with st.expander("📦 Scarica tutte le fatture del mese"):
+            combined = st.checkbox(
+                "Aggiungi un PDF unico con tutti gli studenti",
+                key="zip_combined"
+            )
+            # stessa chiave = stesso ZIP: non si rigenera finché i dati non cambiano
+            key = f"fatture:{year}-{month:02d}:{int(combined)}:{store.stamp('students', 'lessons')}"
+            job_panel(
+                key, "fatture", ("Prepara ZIP", "Scarica ZIP"),
+                invoices_zip_job, store, year, month, combined,
+                file_name=f"fatture_{year}_{month:02d}.zip",
+                mime="application/zip",
+            )
+
     # ── Dettaglio e ricerca
     st.subheader(f"Dettaglio {month:02d}/{year}")
     search_rep = st.text_input(
         "🔍 Cerca studente",
         value="",
         key="search_report",
-        help="Digita parte del nome per filtrare"
+        help="Digita l'inizio del nome o del cognome per filtrare"
     )
 
     # ── Totali per studente
-    tot_less   = les_m.groupby("student_id")["amount"].sum()
-    tot_sum    = sum_m.groupby("student_id")["price"].sum()
-    student_ids = sorted(
-        set(tot_less.index).union(tot_sum.index),
-        key=lambda sid: student_label(sid).split(" — ")[0].lower()
-    )
+    student_ids = sorted(month_cells, key=lambda sid: student_name(sid).lower())
     if search_rep:
-        student_ids = [
-            sid for sid in student_ids
-            if search_rep.lower() in student_label(sid).lower()
-        ]
-
-    # ── Ciclo dettagli studenti
-    for sid in student_ids:
-        name  = student_label(sid).split(" — ")[0]
-        l_tot = tot_less.get(sid, 0.0)
-        s_tot = tot_sum.get(sid, 0.0)
+        matches = search_index().students(search_rep)
+        student_ids = [sid for sid in student_ids if sid in matches]
+
+    @fragment
+    def report_row(sid, year, month):
+        cell  = month_cells[sid]
+        name  = student_name(sid)
+        l_tot = cell["lesson_amount"]
+        s_tot = cell["summary_amount"]
         grand = l_tot + s_tot
-        rows  = les_m[les_m["student_id"] == sid].to_dict("records")
 
         c1, c2, c3, c4, c5, c6 = st.columns([3, 2, 2, 2, 1, 1])
         c1.write(f"**{name}**")
@@ -637,22 +785,115 @@ elif page == "Report Mensile":
         c3.write(f"Riassunti: {s_tot:.2f} EUR")
         c4.write(f"**Totale: {grand:.2f} EUR**")
 
-        # Toggle Pagato
-        paid = not payments[
-            (payments.student_id == sid) &
-            (payments.year       == year) &
-            (payments.month      == month)
-        ].empty
-        label = "🟢" if paid else "🔴"
+        # Toggle Pagato (riesegue solo questa riga)
+        label = "🟢" if is_paid(sid, year, month) else "🔴"
         if c5.button(label, key=f"pay_{sid}_{year}_{month}"):
             toggle_paid(sid, year, month)
 
-        # Scarica PDF
-        if rows and c6.download_button(
+        # Scarica PDF: generato solo al click (e memorizzato per contenuto)
+        if cell["lessons"] and c6.download_button(
             "📄",
-            data=generate_invoice_pdf(name, rows, year, month, l_tot),
+            data=partial(invoice_pdf_for, sid, name, year, month, l_tot),
             file_name=f"{name}_{year}_{month:02d}.pdf",
             mime="application/pdf",
             key=f"pdf_{sid}_{year}_{month}"
         ):
             pass
+
+    # ── Ciclo dettagli studenti
+    for sid in student_ids:
+        report_row(sid, year, month)
+
+
+
+# ───────────────────────── ANALISI ──────────────────────────────
+elif page == "Analisi":
+    st.header("Analisi")
+
+    # aggregati di tutti gli anni, ricalcolati solo quando cambiano i dati
+    analytics = store.derived("analytics", ("lessons", "summaries", "payments"), Analytics)
+    years = analytics.years()
+    sel = st.multiselect("Anni", years, default=years[:1], key="analytics_years")
+
+    if not sel:
+        st.info("Scegli almeno un anno.")
+    else:
+        monthly = analytics.monthly_for(sel)
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Lezioni", f"{monthly['lessons'].sum():.2f} EUR")
+        c2.metric("Riassunti", f"{monthly['summaries'].sum():.2f} EUR")
+        c3.metric("Totale", f"{monthly['total'].sum():.2f} EUR")
+
+        # ── Entrate per mese
+        st.subheader("Entrate per mese")
+        st.bar_chart(monthly[["lessons", "summaries"]].rename(
+            columns={"lessons": "Lezioni", "summaries": "Riassunti"}
+        ))
+
+        # ── Riassunti per autore
+        authors = analytics.authors_for(sel)
+        st.markdown(
+            f"<div style='margin-bottom:12px;font-size:1rem;'>"
+            f"<b>Chiara:</b> {authors.get('C', 0.0):.2f} EUR&nbsp;&nbsp;"
+            f"<b>Pierangelo:</b> {authors.get('P', 0.0):.2f} EUR"
+            f"</div>",
+            unsafe_allow_html=True
+        )
+
+        columns = {"lessons": "Lezioni (EUR)", "summaries": "Riassunti (EUR)", "total": "Totale (EUR)"}
+
+        # ── Studenti con le entrate maggiori
+        st.subheader("Studenti principali")
+        top = analytics.top_students(sel)
+        top.index = top.index.map(student_name)
+        st.dataframe(top.rename(columns=columns).rename_axis("Studente"))
+
+        # ── Da incassare: mesi di lezioni non pagati e riassunti non pagati
+        st.subheader("Da incassare")
+        unpaid = analytics.unpaid_for(sel)
+        if unpaid.empty:
+            st.success("Tutto incassato.")
+        else:
+            st.caption(f"{len(unpaid)} studenti · {unpaid['total'].sum():.2f} EUR")
+            unpaid.index = unpaid.index.map(student_name)
+            st.dataframe(unpaid.rename(columns=columns).rename_axis("Studente"))
+
+    # ── Registro per il commercialista (lavoro in background)
+    with st.expander("🧾 Registro per il commercialista"):
+        import ledger  # solo su questa pagina
+
+        today = date.today()
+        c1, c2, c3 = st.columns(3)
+        start = c1.date_input("Dal", date(today.year - 1, 1, 1), key="ledger_start")
+        end = c2.date_input("Al", today, key="ledger_end")
+        fmt = c3.selectbox("Formato", ledger.formats(), key="ledger_fmt")
+        if start > end:
+            st.error("La data iniziale è successiva a quella finale.")
+        else:
+            stamp = store.stamp("students", "lessons", "summaries", "payments")
+            job_panel(
+                f"registro:{start}:{end}:{fmt}:{stamp}", "registro",
+                ("Prepara registro", "Scarica registro"),
+                ledger_job, store, start, end, fmt,
+                file_name=f"registro_{start:%Y%m%d}_{end:%Y%m%d}.{fmt.lower()}",
+                mime=ledger.MIME[fmt],
+            )
+
+
+# ───────────────────────── METRICHE ─────────────────────────────
+# Con TUTOR_METRICS=1: record del run nel log (JSON) e, per l'admin, in sidebar
+metrics.lap(f"pagina {page}")
+record = metrics.finish()
+if record is not None and TENANT.get("admin", not is_multi(TENANTS)):
+    with st.sidebar.expander("⏱ Metriche del run"):
+        st.caption(f"Totale {record['total_ms']:.0f} ms · {record['widgets']} widget")
+        st.dataframe(
+            pd.DataFrame(record["phases_ms"].items(), columns=["Fase", "ms"]),
+            hide_index=True,
+        )
+        if record["io_bytes"]:
+            st.dataframe(
+                pd.DataFrame.from_dict(record["io_bytes"], orient="index")
+                .rename_axis("File").reset_index(),
+                hide_index=True,
+            )
@@ -0,0 +1,250 @@
+"""
+Benchmark del Tutor Manager su dati sintetici.
+
+generate() scrive in una cartella i cinque CSV con dati casuali ma
+deterministici (stesso seed, stessi file), in scala rispetto ai volumi reali
+(scale=1: ~85 studenti, ~400 lezioni, ~80 riassunti, ~100 pagamenti).
+
+Il benchmark misura, su quei dati, i percorsi usati dalle pagine dell'app:
+lettura/scrittura dei CSV, etichette degli studenti, Store.month e
+daily_view (Lezioni), ricerca (Riassunti), aggregazione
+mensile e PDF (Report Mensile), più insert/update/delete su ogni engine.
+Per ogni voce riporta la mediana dei tempi e il picco di memoria
+(tracemalloc, che vede anche gli array di numpy).
+
+    python bench.py                      # scala 1
+    python bench.py --scale 10 --scale 100 --repeat 5 --out bench_output.txt
+    python bench.py --generate dati/ --scale 10   # solo i CSV
+"""
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from indexes import MonthlyRollup, SearchIndex, StudentIndex, daily_view
+from invoices import generate_invoice_pdf
+from storage import (
+    COLUMNS, KEYS, TABLES, CsvEngine, Store, make_engine, save_csv, table_files,
+)
+
+# Volumi a scala 1, presi dai CSV attuali
+BASE = {"students": 85, "lessons": 400, "summaries": 80, "payments": 100}
+
+FIRST = ["ALESSIA", "GIORGIA", "LUCA", "MARCO", "FRANCESCA", "NATASHA", "SOFIA",
+         "ANDREA", "CHIARA", "DAVIDE", "ELENA", "FEDERICO", "GIULIA", "MATTEO"]
+LAST = ["ROSSI", "BIANCHI", "GIORDANI", "CAVICCHIOLI", "AMBROSI", "GROSSO",
+        "ESPOSITO", "ROMANO", "COLOMBO", "RICCI", "MARINO", "GRECO"]
+TOPICS = ["MAPPE", "DIRITTO PRIVATO", "SISTEMI GIURIDICI COMPARATI", "COSTITUZIONALE",
+          "DIRITTI REALI", "OBBLIGAZIONI", "PROCEDURA CIVILE", "DIRITTO PENALE",
+          "RESCISSIONE", "RISOLUZIONE", "CONTRATTI", "SUCCESSIONI"]
+
+
+# ───────────────────────────── GENERATORE ──────────────────────────────
+def _id(rng) -> str:
+    return uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+
+
+def generate(root: Path, scale: float = 1, seed: int = 0, start: date = date(2024, 1, 1),
+             months: int = 24) -> dict:
+    """Scrive i CSV sintetici in root e restituisce il numero di righe per tabella."""
+    rng = random.Random(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    n = {t: max(1, round(v * scale)) for t, v in BASE.items()}
+    days = months * 30
+
+    students = pd.DataFrame({
+        "id": [_id(rng) for _ in range(n["students"])],
+        "name": [f"{rng.choice(FIRST)} {rng.choice(LAST)}" for _ in range(n["students"])],
+        "hourly_rate": [float(rng.choice((15, 18, 20, 25))) for _ in range(n["students"])],
+        "note": ["" if rng.random() < 0.8 else "recupero" for _ in range(n["students"])],
+    })
+    sids = list(students["id"])
+    rates = dict(zip(students["id"], students["hourly_rate"]))
+
+    def day():
+        return start + timedelta(days=rng.randrange(days))
+
+    lesson_rows = []
+    for _ in range(n["lessons"]):
+        sid, dur = rng.choice(sids), rng.choice((45, 60, 60, 90, 120))
+        lesson_rows.append((_id(rng), sid, day().isoformat(), dur, dur / 60 * rates[sid]))
+    lessons = pd.DataFrame(lesson_rows, columns=COLUMNS["lessons"])
+
+    summary_rows = []
+    for _ in range(n["summaries"]):
+        d = day()
+        summary_rows.append((
+            _id(rng), rng.choice(sids), d.isoformat(),
+            (d + timedelta(days=rng.randrange(20))).isoformat(),
+            " + ".join(rng.sample(TOPICS, rng.randint(1, 3))),
+            float(rng.choice((25, 35, 50, 70))), rng.choice("CCCP"), rng.random() < 0.7,
+        ))
+    summaries = pd.DataFrame(summary_rows, columns=COLUMNS["summaries"])
+
+    pay = set()
+    while len(pay) < min(n["payments"], n["students"] * months):
+        d = day()
+        pay.add((rng.choice(sids), d.year, d.month))
+    payments = pd.DataFrame(sorted(pay), columns=COLUMNS["payments"])
+
+    lesson_days = sorted(set(lessons["date"]))
+    checked = rng.sample(lesson_days, len(lesson_days) // 4)
+    day_checks = pd.DataFrame({"date": sorted(checked), "checked": True})
+
+    frames = {"students": students, "lessons": lessons, "summaries": summaries,
+              "payments": payments, "day_checks": day_checks}
+    files = table_files(root)
+    for table in TABLES:
+        save_csv(frames[table], files[table])
+    return {t: len(df) for t, df in frames.items()}
+
+
+# ───────────────────────────── BENCHMARK ───────────────────────────────
+def timed(fn, repeat: int):
+    """(mediana dei secondi, picco di memoria in byte del primo giro)."""
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times), peak
+
+
+def cases(root: Path):
+    """Coppie (nome, funzione) sui dati di root; le funzioni non modificano i CSV."""
+    raw = CsvEngine(root)
+    store = Store(root, CsvEngine(root))
+    students = store.load("students")
+    lessons = store.load("lessons")
+    summaries = store.load("summaries")
+    index = StudentIndex(students)
+    search = SearchIndex(students, summaries)
+    rollup = MonthlyRollup(lessons, summaries)
+
+    # mese con più lezioni e studente con più lezioni in quel mese
+    dt = lessons["date"].dt
+    ym = int((dt.year * 100 + dt.month).mode()[0])
+    year, month = ym // 100, ym % 100
+    month_df = store.month("lessons", year, month)
+    sid = month_df["student_id"].value_counts().index[0]
+    rows = month_df[month_df["student_id"] == sid].to_dict("records")
+    total = sum(r["amount"] for r in rows)
+
+    out = Path(tempfile.mkdtemp())
+
+    yield "load_csv lessons", lambda: raw.load("lessons")
+    yield "load + schema (tutte)", lambda: [Store(root, CsvEngine(root)).load(t) for t in TABLES]
+    yield "save_csv lessons", lambda: save_csv(lessons, out / "lessons.csv")
+    yield "student_label x lezioni", lambda: [index.label(s) for s in lessons["student_id"]]
+    # le stesse funzioni usate dalla pagina Lezioni
+    yield "Lezioni: Store.month", lambda: store.month("lessons", year, month)
+    yield "Lezioni: daily_view", lambda: daily_view(month_df, index)
+    yield "Riassunti: indice ricerca", lambda: SearchIndex(students, summaries)
+    yield "Riassunti: ricerca 'dir pri'", lambda: summaries[summaries["id"].isin(search.summaries("dir pri"))]
+    yield "Report: rollup mensile", lambda: MonthlyRollup(lessons, summaries)
+    yield "Report: totali del mese", lambda: (rollup.students(year, month), rollup.month_totals(year, month))
+    yield "generate_invoice_pdf", lambda: generate_invoice_pdf(index.name(sid), rows, year, month, total)
+    shutil.rmtree(out, ignore_errors=True)
+
+
+def write_cases(root: Path, kind: str, ops: int = 20):
+    """insert, update e delete di `ops` lezioni su una copia dei dati con l'engine `kind`."""
+    work = Path(tempfile.mkdtemp())
+    for p in table_files(root).values():
+        shutil.copy(p, work)
+    store = Store(work, make_engine(work, kind))
+    lessons = store.load("lessons")
+    sid = lessons["student_id"].iloc[0]
+    ids = [f"bench{i:04d}" for i in range(ops)]
+
+    def insert():
+        for i in ids:
+            store.insert("lessons", lessons, {"id": i, "student_id": sid, "date": "2030-01-01",
+                                              "duration_min": 60, "amount": 20.0})
+
+    def update():
+        for i in ids:
+            store.update("lessons", lessons, store.labels("lessons", KEYS["lessons"], i)[0],
+                         {"duration_min": 90})
+
+    def delete():
+        for i in ids:
+            store.delete("lessons", lessons, store.labels("lessons", KEYS["lessons"], i))
+
+    results = []
+    for name, fn in (("insert", insert), ("update", update), ("delete", delete)):
+        t = time.perf_counter()
+        fn()
+        results.append((f"{kind}: {name} x{ops}", time.perf_counter() - t))
+    store.engine.close()
+    shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def run(scale: float, repeat: int, seed: int) -> list:
+    """Righe del report: (scala, voce, secondi, picco MiB o None)."""
+    root = Path(tempfile.mkdtemp())
+    try:
+        counts = generate(root, scale, seed)
+        report = [(scale, f"dati: {counts}", None, None)]
+        for name, fn in cases(root):
+            secs, peak = timed(fn, repeat)
+            report.append((scale, name, secs, peak / 2**20))
+        for kind in ("csv", "journal", "sqlite"):
+            report += [(scale, name, secs, None) for name, secs in write_cases(root, kind)]
+        return report
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def format_report(rows) -> str:
+    lines = []
+    for scale, name, secs, peak in rows:
+        if secs is None:
+            lines.append(f"\n[scala {scale:g}] {name}")
+            continue
+        mem = f"{peak:8.2f} MiB" if peak is not None else ""
+        lines.append(f"  {name:<32} {secs * 1000:10.2f} ms {mem}")
+    return "\n".join(lines).lstrip("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=float, action="append",
+                        help="moltiplicatore dei volumi (ripetibile, default 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni per voce")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="scrive il report anche in questo file")
+    parser.add_argument("--generate", type=Path, metavar="DIR",
+                        help="genera solo i CSV in DIR e termina")
+    args = parser.parse_args(argv)
+    scales = args.scale or [1]
+
+    if args.generate:
+        print(generate(args.generate, scales[0], args.seed))
+        return
+
+    rows = []
+    for scale in scales:
+        rows += run(scale, args.repeat, args.seed)
+    text = format_report(rows)
+    print(text)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
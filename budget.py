@@ -0,0 +1,95 @@
+"""
+Budget di avvio: misura in processi nuovi (cache fredde)
+
+- import:   tempo di import dei moduli dell'app (pandas compreso);
+- Home:     primo render dopo il login, script dell'app compreso;
+- <pagina>: passaggio dalla Home alla pagina (lettura delle sue tabelle),
+            con i dati copiati in una cartella temporanea.
+
+    python budget.py            # stampa le misure, esce con 1 se un budget è superato
+    python budget.py --json     # una riga JSON per misura
+
+I limiti in BUDGET_S vanno aggiornati insieme alle modifiche che li spostano.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).parent
+
+# secondi, misurati su una macchina a 1 CPU
+BUDGET_S = {
+    "import":         0.75,
+    "Home":           1.25,
+    "Studenti":       1.0,
+    "Lezioni":        1.0,
+    "Riassunti":      1.0,
+    "Report Mensile": 1.0,
+    "Analisi":        1.0,
+}
+
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {root!r})
+t = time.perf_counter()
+import pandas, storage, indexes, invoices, tenants, jobs
+print(time.perf_counter() - t)
+"""
+
+PAGE_SNIPPET = """
+import os, sys, time
+from streamlit.testing.v1 import AppTest
+os.chdir({root!r})
+at = AppTest.from_file("app.py", default_timeout=120)
+at.session_state["password_correct"] = True
+at.session_state["tenant"] = "default"
+t = time.perf_counter()
+at.run()
+if {page!r} != "Home":
+    # il primo run (Home) serve solo per avere la sidebar: si misura il secondo
+    t = time.perf_counter()
+    at.sidebar.radio[0].set_value({page!r}).run()
+assert not at.exception, [e.value for e in at.exception]
+print(time.perf_counter() - t)
+"""
+
+
+def _run(snippet: str, **kw) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", snippet.format(**kw)],
+        check=True, capture_output=True, text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure() -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        for p in APP_DIR.iterdir():
+            if p.suffix in (".py", ".csv", ".jpeg"):
+                shutil.copy(p, tmp)
+        env_root = os.path.abspath(tmp)
+        results = {"import": _run(IMPORT_SNIPPET, root=env_root)}
+        for page in BUDGET_S:
+            if page != "import":
+                results[page] = _run(PAGE_SNIPPET, root=env_root, page=page)
+    return results
+
+
+def main(argv) -> int:
+    results = measure()
+    over = [k for k, v in results.items() if v > BUDGET_S[k]]
+    for name, secs in results.items():
+        if "--json" in argv:
+            print(json.dumps({"metric": name, "seconds": round(secs, 3), "budget": BUDGET_S[name]}))
+        else:
+            flag = "  OLTRE IL BUDGET" if name in over else ""
+            print(f"{name:<16} {secs:6.2f}s  (budget {BUDGET_S[name]:.2f}s){flag}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,354 @@
+"""
+Indici in memoria costruiti dalle tabelle dello Store.
+
+Si ottengono con store.derived(...), che li ricostruisce solo quando cambia
+la versione dei dati; i metodi apply() li tengono aggiornati riga per riga
+dopo insert/update/delete, senza ricostruirli.
+"""
+import re
+from bisect import bisect_left, insort
+
+import pandas as pd
+
+from invoices import fold_text
+
+
+def _label(name, rate) -> str:
+    return f"{name} — {rate:.2f} EUR/h"
+
+
+class StudentIndex:
+    """id studente -> (nome, tariffa, etichetta), con lookup O(1)."""
+
+    def __init__(self, students: pd.DataFrame):
+        self.by_id = {
+            sid: (str(name), rate, _label(name, rate))
+            for sid, name, rate in zip(students["id"], students["name"], students["hourly_rate"])
+        }
+        self._sorted = None
+
+    def label(self, sid) -> str:
+        hit = self.by_id.get(sid)
+        return hit[2] if hit else sid
+
+    def name(self, sid) -> str:
+        hit = self.by_id.get(sid)
+        return hit[0] if hit else str(sid)
+
+    def rate(self, sid) -> float:
+        return self.by_id[sid][1]
+
+    def sorted_ids(self) -> list:
+        """Id ordinati per nome, come nelle selectbox."""
+        if self._sorted is None:
+            self._sorted = sorted(self.by_id, key=lambda sid: self.by_id[sid][0])
+        return self._sorted
+
+    def apply(self, table, op, old, new) -> bool:
+        if table != "students":
+            return False
+        if old is not None:
+            self.by_id.pop(old["id"], None)
+        if new is not None:
+            self.by_id[new["id"]] = (str(new["name"]), new["hourly_rate"],
+                                     _label(new["name"], new["hourly_rate"]))
+        self._sorted = None
+        return True
+
+
+def daily_view(df: pd.DataFrame, index: StudentIndex) -> list:
+    """
+    Lezioni del mese per giorno, dal più recente (pagina Lezioni):
+    [(giorno, "gg/mm/aaaa", [(etichetta, id lezione, nome studente), ...]), ...].
+    Nomi e date formattate sono calcolati per colonna, poi un solo passaggio.
+    """
+    df = df.sort_index().sort_values("date", ascending=False, kind="stable")
+    # su una colonna categorica map() lavora sulle categorie, non sulle righe
+    names  = df["student_id"].map(index.name).astype(str)
+    titles = df["date"].dt.strftime("%d/%m/%Y")
+    view = []
+    for label, lid, day, title, name in zip(df.index, df["id"], df["date"], titles, names):
+        if not view or view[-1][0] != day:
+            view.append((day, title, []))
+        view[-1][2].append((label, lid, name))
+    return view
+
+
+def _year_month(value):
+    """(anno, mese) di una data ISO o Timestamp; None se mancante/non valida."""
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return None
+    if pd.isna(ts):
+        return None
+    return ts.year, ts.month
+
+
+def _num(value) -> float:
+    return 0.0 if pd.isna(value) else float(value)
+
+
+class MonthlyRollup:
+    """
+    Totali per (anno, mese, studente) di lezioni e riassunti:
+    numero di lezioni, minuti, importo lezioni, numero e importo riassunti.
+    """
+
+    FIELDS = ("lessons", "minutes", "lesson_amount", "summaries", "summary_amount")
+
+    def __init__(self, lessons: pd.DataFrame, summaries: pd.DataFrame):
+        # {(anno, mese): {student_id: {campo: valore}}}
+        self.months = {}
+        self._load(lessons, {"lessons": ("date", "size"),
+                             "minutes": ("duration_min", "sum"),
+                             "lesson_amount": ("amount", "sum")})
+        self._load(summaries, {"summaries": ("date", "size"),
+                               "summary_amount": ("price", "sum")})
+
+    def _load(self, df: pd.DataFrame, aggs: dict):
+        dt = df["date"]
+        df = df.assign(_y=dt.dt.year, _m=dt.dt.month)[dt.notna()]
+        if df.empty:
+            return
+        agg = df.groupby(["_y", "_m", "student_id"], observed=True).agg(**aggs)
+        for (y, m, sid), values in zip(agg.index, agg.to_dict("records")):
+            cell = self._cell(int(y), int(m), sid)
+            for field, val in values.items():
+                cell[field] = _num(val)
+
+    def _cell(self, year, month, sid) -> dict:
+        month_cells = self.months.setdefault((year, month), {})
+        if sid not in month_cells:
+            month_cells[sid] = dict.fromkeys(self.FIELDS, 0.0)
+        return month_cells[sid]
+
+    def students(self, year, month) -> dict:
+        """student_id -> totali del mese (solo studenti con dati)."""
+        return self.months.get((year, month), {})
+
+    def month_totals(self, year, month) -> tuple:
+        """(importo lezioni, importo riassunti) del mese."""
+        cells = self.students(year, month).values()
+        return (sum(c["lesson_amount"] for c in cells),
+                sum(c["summary_amount"] for c in cells))
+
+    def _add(self, table, row, sign):
+        ym = _year_month(row.get("date"))
+        if ym is None:
+            return
+        cell = self._cell(*ym, row["student_id"])
+        if table == "lessons":
+            cell["lessons"] += sign
+            cell["minutes"] += sign * _num(row.get("duration_min"))
+            cell["lesson_amount"] += sign * _num(row.get("amount"))
+        else:
+            cell["summaries"] += sign
+            cell["summary_amount"] += sign * _num(row.get("price"))
+        if cell["lessons"] <= 0 and cell["summaries"] <= 0:
+            del self.months[ym][row["student_id"]]
+
+    def apply(self, table, op, old, new) -> bool:
+        if table not in ("lessons", "summaries"):
+            return False
+        if old is not None:
+            self._add(table, old, -1)
+        if new is not None:
+            self._add(table, new, +1)
+        return True
+
+
+def tokens(text) -> set:
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return set()
+    return set(re.findall(r"\w+", fold_text(text)))
+
+
+class _PrefixIndex:
+    """token -> insieme di id, con i token ordinati per la ricerca per prefisso."""
+
+    def __init__(self):
+        self.postings = {}
+        self.sorted_tokens = []
+
+    def add(self, doc, words):
+        for w in words:
+            if w not in self.postings:
+                self.postings[w] = set()
+                insort(self.sorted_tokens, w)
+            self.postings[w].add(doc)
+
+    def remove(self, doc, words):
+        for w in words:
+            docs = self.postings.get(w)
+            if docs is None:
+                continue
+            docs.discard(doc)
+            if not docs:
+                del self.postings[w]
+                del self.sorted_tokens[bisect_left(self.sorted_tokens, w)]
+
+    def prefix(self, p) -> set:
+        """id dei documenti con almeno un token che inizia per p."""
+        out = set()
+        i = bisect_left(self.sorted_tokens, p)
+        while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(p):
+            out |= self.postings[self.sorted_tokens[i]]
+            i += 1
+        return out
+
+
+class SearchIndex:
+    """
+    Ricerca per prefisso, senza accenti e maiuscole, su titoli dei riassunti
+    e nomi degli studenti. Ogni parola della query deve essere l'inizio di
+    una parola del titolo o del nome dello studente.
+    """
+
+    def __init__(self, students: pd.DataFrame, summaries: pd.DataFrame):
+        self.names = _PrefixIndex()
+        self.titles = _PrefixIndex()
+        self.name_words = {}
+        self.title_words = {}
+        self.summary_student = {}
+        self.by_student = {}
+        for sid, name in zip(students["id"], students["name"]):
+            self._add_student(sid, name)
+        for rid, sid, title in zip(summaries["id"], summaries["student_id"], summaries["title"]):
+            self._add_summary(rid, sid, title)
+
+    def _add_student(self, sid, name):
+        self.name_words[sid] = tokens(name)
+        self.names.add(sid, self.name_words[sid])
+
+    def _remove_student(self, sid):
+        self.names.remove(sid, self.name_words.pop(sid, ()))
+
+    def _add_summary(self, rid, sid, title):
+        self.title_words[rid] = tokens(title)
+        self.titles.add(rid, self.title_words[rid])
+        self.summary_student[rid] = sid
+        self.by_student.setdefault(sid, set()).add(rid)
+
+    def _remove_summary(self, rid):
+        self.titles.remove(rid, self.title_words.pop(rid, ()))
+        sid = self.summary_student.pop(rid, None)
+        self.by_student.get(sid, set()).discard(rid)
+
+    def students(self, query) -> set:
+        """Id degli studenti il cui nome contiene tutte le parole della query."""
+        words = tokens(query)
+        if not words:
+            return set(self.name_words)
+        result = None
+        for w in words:
+            hits = self.names.prefix(w)
+            result = hits if result is None else result & hits
+            if not result:
+                break
+        return result
+
+    def summaries(self, query) -> set:
+        """Id dei riassunti che corrispondono alla query (titolo o studente)."""
+        words = tokens(query)
+        if not words:
+            return set(self.title_words)
+        result = None
+        for w in words:
+            hits = set(self.titles.prefix(w))
+            for sid in self.names.prefix(w):
+                hits |= self.by_student.get(sid, set())
+            result = hits if result is None else result & hits
+            if not result:
+                break
+        return result
+
+    def apply(self, table, op, old, new) -> bool:
+        if table == "students":
+            if old is not None:
+                self._remove_student(old["id"])
+            if new is not None:
+                self._add_student(new["id"], new["name"])
+            return True
+        if table == "summaries":
+            if old is not None:
+                self._remove_summary(old["id"])
+            if new is not None:
+                self._add_summary(new["id"], new["student_id"], new["title"])
+            return True
+        return False
+
+
+class Analytics:
+    """
+    Aggregati pluriennali per la pagina Analisi, calcolati una volta per
+    versione dei dati con groupby sulle colonne tipizzate; i metodi filtrano
+    per anno le tabelle già aggregate.
+    """
+
+    def __init__(self, lessons: pd.DataFrame, summaries: pd.DataFrame, payments: pd.DataFrame):
+        les = lessons[lessons["date"].notna()]
+        les = les.assign(year=les["date"].dt.year, month=les["date"].dt.month)
+        summ = summaries[summaries["date"].notna()]
+        summ = summ.assign(year=summ["date"].dt.year, month=summ["date"].dt.month)
+
+        # entrate per mese: lezioni e riassunti
+        self.monthly = pd.concat([
+            les.groupby(["year", "month"])["amount"].sum().rename("lessons"),
+            summ.groupby(["year", "month"])["price"].sum().rename("summaries"),
+        ], axis=1).fillna(0.0).sort_index()
+        self.monthly["total"] = self.monthly["lessons"] + self.monthly["summaries"]
+
+        # riassunti per autore e anno
+        self.authors = (summ.groupby(["year", "author"])["price"].sum()
+                        .unstack("author", fill_value=0.0))
+
+        # entrate per studente e anno
+        self.students = pd.concat([
+            les.groupby(["student_id", "year"], observed=True)["amount"].sum().rename("lessons"),
+            summ.groupby(["student_id", "year"], observed=True)["price"].sum().rename("summaries"),
+        ], axis=1).fillna(0.0)
+        self.students["total"] = self.students["lessons"] + self.students["summaries"]
+
+        # da incassare: mesi di lezioni senza pagamento e riassunti non pagati
+        per_month = les.groupby(["student_id", "year", "month"], observed=True)["amount"].sum()
+        paid = pd.MultiIndex.from_arrays([
+            payments["student_id"].astype(str), payments["year"].astype("int64"),
+            payments["month"].astype("int64"),
+        ])
+        keys = pd.MultiIndex.from_arrays([
+            per_month.index.get_level_values(0).astype(str),
+            per_month.index.get_level_values(1).astype("int64"),
+            per_month.index.get_level_values(2).astype("int64"),
+        ])
+        unpaid_lessons = per_month[~keys.isin(paid)].groupby(level=["student_id", "year"],
+                                                             observed=True).sum()
+        unpaid_summaries = (summ[~summ["paid"]]
+                            .groupby(["student_id", "year"], observed=True)["price"].sum())
+        self.unpaid = pd.concat([unpaid_lessons.rename("lessons"),
+                                 unpaid_summaries.rename("summaries")], axis=1).fillna(0.0)
+        self.unpaid["total"] = self.unpaid["lessons"] + self.unpaid["summaries"]
+
+    def years(self) -> list:
+        return sorted(self.monthly.index.get_level_values("year").unique(), reverse=True)
+
+    def monthly_for(self, years) -> pd.DataFrame:
+        """Entrate per mese negli anni scelti, indice "aaaa-mm"."""
+        df = self.monthly[self.monthly.index.get_level_values("year").isin(years)]
+        df.index = [f"{y}-{m:02d}" for y, m in df.index]
+        return df
+
+    def authors_for(self, years) -> pd.Series:
+        """Totale riassunti per autore (C/P) negli anni scelti."""
+        return self.authors[self.authors.index.isin(years)].sum()
+
+    def _by_student(self, df, years) -> pd.DataFrame:
+        df = df[df.index.get_level_values("year").isin(years)]
+        return df.groupby(level="student_id", observed=True).sum()
+
+    def top_students(self, years, n: int = 10) -> pd.DataFrame:
+        return self._by_student(self.students, years).nlargest(n, "total")
+
+    def unpaid_for(self, years) -> pd.DataFrame:
+        df = self._by_student(self.unpaid, years)
+        return df[df["total"] > 0].sort_values("total", ascending=False)
@@ -0,0 +1,194 @@
+"""
+Generazione dei PDF di riepilogo lezioni (fatture mensili).
+
+generate_invoice_pdf costruisce il documento; invoice_pdf lo memorizza per
+(studente, anno, mese, hash del contenuto), così un PDF già prodotto non
+viene rigenerato finché le lezioni del mese non cambiano.
+
+write_invoice_zip produce in parallelo (pool di processi) i PDF di tutti gli
+studenti di un mese e li scrive in un unico archivio ZIP.
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+import zipfile
+from collections import OrderedDict
+
+# Numero massimo di PDF tenuti in memoria
+CACHE_SIZE = 256
+
+# Sotto questa soglia l'avvio del pool costa più della generazione seriale
+PARALLEL_MIN_JOBS = 300
+BATCH_SIZE = 25
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def safe_text(text):
+    """
+    Rimuove caratteri non compatibili con 'latin-1'.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    return unicodedata.normalize("NFKD", text).encode("latin-1", "ignore").decode("latin-1")
+
+
+def fold_text(text):
+    """
+    Forma normalizzata per la ricerca: come safe_text (accenti rimossi),
+    in minuscolo.
+    """
+    return safe_text(text).lower()
+
+
+def generate_invoice_pdf(name, rows, year, month, total):
+    from fpdf import FPDF
+
+    pdf = FPDF(format="A4")
+    draw_invoice(pdf, name, rows, year, month, total)
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def draw_invoice(pdf, name, rows, year, month, total):
+    """Aggiunge a `pdf` una pagina con il riepilogo lezioni dello studente."""
+    pdf.add_page()
+
+    # Usa un font standard compatibile
+    pdf.set_font("Helvetica", size=14)
+
+    # Titolo
+    title = f"Report lezioni - {name} [{month:02d}/{year}]"
+    pdf.cell(0, 10, txt=safe_text(title), ln=True, align="C")
+    pdf.ln(5)
+
+    pdf.set_font("Helvetica", size=12)
+
+    if not rows:
+        pdf.cell(0, 8, txt=safe_text("Nessuna lezione registrata."), ln=True)
+    else:
+        for r in rows:
+            data = r.get("date", "")
+            if hasattr(data, "strftime"):
+                data = data.strftime("%Y-%m-%d")
+            data = safe_text(data)
+            dur  = int(r.get("duration_min", 0))
+            amt  = float(r.get("amount", 0.0))
+            line = f"{data}   |   {dur} min   |   {amt:.2f} EUR"
+            pdf.cell(0, 8, txt=safe_text(line), ln=True)
+
+    pdf.ln(5)
+    pdf.set_font("Helvetica", style="B", size=12)
+    pdf.cell(0, 10, txt=safe_text(f"Totale mese: {total:.2f} EUR"), ln=True, align="R")
+
+
+def content_hash(name, rows, total) -> str:
+    h = hashlib.sha1(repr((name, float(total))).encode())
+    for r in rows:
+        h.update(repr((r.get("date"), r.get("duration_min"), r.get("amount"))).encode())
+    return h.hexdigest()
+
+
+def invoice_pdf(sid, name, rows, year, month, total):
+    """generate_invoice_pdf con cache LRU per contenuto."""
+    key = (sid, year, month, content_hash(name, rows, total))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = generate_invoice_pdf(name, rows, year, month, total)
+    with _cache_lock:
+        _cache[key] = data
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return data
+
+
+# ───────────────────────────── EXPORT ZIP ──────────────────────────────
+def invoice_file_name(name, year, month) -> str:
+    return f"{name}_{year}_{month:02d}.pdf"
+
+
+def _render_job(job):
+    _, name, rows, year, month, total = job
+    return generate_invoice_pdf(name, rows, year, month, total)
+
+
+def _render_batch(batch):
+    return [_render_job(job) for job in batch]
+
+
+def _render_combined(jobs):
+    from fpdf import FPDF
+
+    pdf = FPDF(format="A4")
+    for _, name, rows, year, month, total in jobs:
+        draw_invoice(pdf, name, rows, year, month, total)
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def write_invoice_zip(out, jobs, combined=False, workers=None, progress=None):
+    """
+    Scrive in `out` (percorso o file binario) uno ZIP con un PDF per job,
+    dove ogni job è (sid, name, rows, year, month, total).
+
+    Oltre PARALLEL_MIN_JOBS i PDF sono generati su un pool di processi, a
+    blocchi di BATCH_SIZE, e scritti nell'archivio appena pronti; i blocchi
+    in volo sono al massimo 2 per worker, quindi la memoria non cresce con
+    il numero di studenti. Con combined=True aggiunge anche un PDF unico con
+    una pagina per studente. progress(fatti, totale), se data, è chiamata
+    dopo ogni PDF aggiunto.
+    """
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    used = set()
+    steps = len(jobs) + bool(combined)
+
+    def add(zf, job, data):
+        sid, name, _, year, month, _ = job
+        fname = invoice_file_name(name, year, month)
+        if fname in used:  # omonimi
+            fname = invoice_file_name(f"{name}_{sid}", year, month)
+        used.add(fname)
+        zf.writestr(fname, data)
+        if progress is not None:
+            progress(len(used), steps)
+
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        if not jobs:
+            return
+        if workers <= 1 or len(jobs) < PARALLEL_MIN_JOBS:
+            for job in jobs:
+                add(zf, job, _render_job(job))
+            if combined:
+                zf.writestr("riepilogo.pdf", _render_combined(jobs))
+                if progress is not None:
+                    progress(steps, steps)
+            return
+
+        # import qui: servono solo per gli export grandi
+        import multiprocessing
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            combined_fut = pool.submit(_render_combined, jobs) if combined else None
+            todo = (jobs[i:i + BATCH_SIZE] for i in range(0, len(jobs), BATCH_SIZE))
+            pending = {}
+            for batch in todo:
+                pending[pool.submit(_render_batch, batch)] = batch
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    for job, data in zip(pending.pop(fut), fut.result()):
+                        add(zf, job, data)
+                    nxt = next(todo, None)
+                    if nxt is not None:
+                        pending[pool.submit(_render_batch, nxt)] = nxt
+            if combined_fut is not None:
+                zf.writestr("riepilogo.pdf", combined_fut.result())
+                if progress is not None:
+                    progress(steps, steps)
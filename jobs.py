@@ -0,0 +1,238 @@
+"""
+Lavori lunghi (ZIP delle fatture, registro per il commercialista, riscritture
+dei dati) eseguiti da un piccolo pool di thread, fuori dal thread dello
+script Streamlit: un rerun non li interrompe e la pagina non li aspetta.
+
+Ogni lavoro ha una chiave (es. "fatture:2025-05:1:<impronta dei dati>"):
+sottomettere di nuovo la stessa chiave restituisce il lavoro già in coda,
+in corso o completato invece di rifarlo. Lo stato sta nella tabella jobs di
+jobs.db (SQLite, nella cartella dati) e il risultato in un file sotto jobs/,
+così a ogni rerun l'interfaccia legge l'avanzamento e può scaricare il
+risultato anche più tardi, da un'altra sessione o dopo un riavvio.
+
+Una funzione di lavoro ha la forma fn(out, *args, progress=..., **kwargs):
+scrive il risultato nel file binario `out` (o non scrive nulla) e chiama
+progress(fatti, totale) quando vuole. I lavori rimasti in coda o in corso
+in un processo terminato risultano falliti ("interrotto").
+
+I thread condividono il GIL con le sessioni: il lavoro pesante di CPU va
+comunque su processi (write_invoice_zip lo fa già oltre una soglia).
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+JOBS_DB = "jobs.db"
+JOBS_DIR = "jobs"
+WORKERS = int(os.environ.get("TUTOR_JOB_WORKERS", 2))
+# Lavori finiti (e risultati) più vecchi di così vengono cancellati
+JOB_TTL_S = 7 * 24 * 3600
+# Intervallo minimo fra due salvataggi dell'avanzamento
+PROGRESS_EVERY_S = 0.25
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+# identifica questo processo anche se il pid viene riusato dopo un riavvio
+OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+log = logging.getLogger("tutor.jobs")
+
+
+def _alive(owner: str) -> bool:
+    """Il processo che possiede il lavoro è ancora in vita?"""
+    if owner == OWNER:
+        return True
+    pid = int(owner.split(":")[0])
+    if pid == os.getpid():
+        return False  # stesso pid, processo precedente
+    if os.name == "nt":
+        return True  # niente os.kill(pid, 0) su Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobRunner:
+    """Pool di worker più la tabella persistente dei lavori di una cartella dati."""
+
+    def __init__(self, root: Path, workers: int = WORKERS):
+        self.root = Path(root)
+        self.dir = self.root / JOBS_DIR
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        self.conn = sqlite3.connect(self.root / JOBS_DB, check_same_thread=False,
+                                    isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " key TEXT PRIMARY KEY, kind TEXT, status TEXT, done INTEGER, total INTEGER,"
+            " result TEXT, error TEXT, owner TEXT, created REAL, updated REAL)"
+        )
+        self._recover()
+        self.prune()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="tutor-job")
+        return self._pool
+
+    def _recover(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, owner FROM jobs WHERE status IN (?, ?)", ACTIVE
+            ).fetchall()
+            for row in rows:
+                if not _alive(row["owner"]):
+                    self._set(row["key"], status=FAILED, error="interrotto")
+
+    def prune(self, ttl_s: float = JOB_TTL_S):
+        """Cancella i lavori finiti da più di ttl_s secondi e i loro risultati."""
+        limit = time.time() - ttl_s
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT key, result FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, limit),
+            ).fetchall()
+            for row in old:
+                if row["result"]:
+                    (self.dir / row["result"]).unlink(missing_ok=True)
+                self.conn.execute("DELETE FROM jobs WHERE key = ?", (row["key"],))
+
+    def _set(self, key: str, **values):
+        values["updated"] = time.time()
+        cols = ", ".join(f"{c} = ?" for c in values)
+        self.conn.execute(f"UPDATE jobs SET {cols} WHERE key = ?", (*values.values(), key))
+
+    def get(self, key: str):
+        """Il lavoro come dict (status, done, total, result, error, ...) o None."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+    def result_path(self, job: dict):
+        """File del risultato di un lavoro completato, se esiste ancora."""
+        if job is None or job["status"] != DONE or not job["result"]:
+            return None
+        path = self.dir / job["result"]
+        return path if path.exists() else None
+
+    def submit(self, key: str, kind: str, fn, *args, **kwargs) -> dict:
+        """
+        Mette in coda fn(out, *args, progress=..., **kwargs) con chiave `key`,
+        a meno che lo stesso lavoro sia già in coda, in corso o completato
+        (con il risultato ancora su disco). Restituisce il lavoro.
+        """
+        with self.lock:
+            # BEGIN IMMEDIATE: controllo e inserimento atomici anche fra processi
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+                if row is not None and (
+                    (row["status"] in ACTIVE and _alive(row["owner"]))
+                    or self.result_path(dict(row)) is not None
+                ):
+                    self.conn.execute("COMMIT")
+                    return dict(row)
+                now = time.time()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, 0, 0, NULL, NULL, ?, ?, ?)",
+                    (key, kind, QUEUED, OWNER, now, now),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self._pending += 1
+            self._executor().submit(self._run, key, fn, args, kwargs)
+        return self.get(key)
+
+    def idle(self) -> bool:
+        """Nessun lavoro di questo processo in coda o in corso."""
+        with self.lock:
+            return self._pending == 0
+
+    def _run(self, key: str, fn, args, kwargs):
+        try:
+            self._execute(key, fn, args, kwargs)
+        finally:
+            with self.lock:
+                self._pending -= 1
+
+    def _execute(self, key: str, fn, args, kwargs):
+        with self.lock:
+            self._set(key, status=RUNNING)
+        self.dir.mkdir(exist_ok=True)
+        name = hashlib.sha1(key.encode()).hexdigest()[:16] + ".out"
+        path = self.dir / name
+        tmp = path.with_name(f".{name}.tmp")
+        last = [0.0]
+
+        def progress(done, total):
+            # salvato al massimo ogni PROGRESS_EVERY_S
+            now = time.monotonic()
+            if now - last[0] >= PROGRESS_EVERY_S or done >= total:
+                last[0] = now
+                with self.lock:
+                    self._set(key, done=int(done), total=int(total))
+
+        try:
+            with open(tmp, "wb") as out:
+                fn(out, *args, progress=progress, **kwargs)
+            os.replace(tmp, path)
+        except Exception as exc:
+            log.exception("lavoro %s fallito", key)
+            tmp.unlink(missing_ok=True)
+            with self.lock:
+                self._set(key, status=FAILED, error=f"{type(exc).__name__}: {exc}")
+            return
+        with self.lock:
+            self._set(key, status=DONE, result=name)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self.conn.close()
+
+
+# JobRunner tenuti in memoria: stesso limite degli Store (uno per tutor attivo)
+MAX_RUNNERS = int(os.environ.get("TUTOR_MAX_STORES", 8))
+
+_runners = OrderedDict()
+_runners_lock = threading.Lock()
+
+
+def open_runner(root: Path) -> JobRunner:
+    """
+    Il JobRunner della cartella dati, condiviso da tutte le sessioni.
+
+    Come open_store(), restano in memoria gli ultimi MAX_RUNNERS usati; i
+    meno recenti vengono chiusi (pool e connessione SQLite), ma solo se non
+    hanno lavori in coda o in corso: quelli restano finché non finiscono.
+    """
+    key = Path(root).resolve()
+    with _runners_lock:
+        if key in _runners:
+            _runners.move_to_end(key)
+            return _runners[key]
+        runner = _runners[key] = JobRunner(key)
+        for old_key in list(_runners)[:-1]:
+            if len(_runners) <= MAX_RUNNERS:
+                break
+            if _runners[old_key].idle():
+                _runners.pop(old_key).close()
+        return runner
@@ -0,0 +1,205 @@
+"""
+Registro per il commercialista: tutte le lezioni e i riassunti di un periodo,
+con nome dello studente, stato del pagamento e subtotali mensili.
+
+ledger() percorre il periodo un mese alla volta con store.month() (i mesi
+chiusi sono letti dalla sola partizione d'archivio) e produce per ogni mese
+le sue righe e il subtotale: in memoria c'è sempre un solo mese.
+write_csv() e write_xlsx() scrivono i blocchi man mano che arrivano, quindi
+il primo byte esce subito anche su più anni. XLSX richiede openpyxl
+(modalità write_only); senza, resta disponibile solo il CSV.
+
+    python ledger.py [cartella_dati] 2024-01-01 2025-12-31 [registro.csv|.xlsx]
+
+Senza file di destinazione il CSV va su stdout.
+"""
+import csv
+import io
+import sys
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from indexes import StudentIndex
+from storage import make_engine, Store
+
+HEADER = ("Data", "Tipo", "Studente", "Descrizione", "Minuti", "Importo (EUR)", "Pagato")
+
+# Righe accumulate prima di ogni scrittura del CSV
+CSV_CHUNK_ROWS = 500
+
+
+def _openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        return None
+    return openpyxl
+
+
+def formats() -> list:
+    """Formati disponibili con le librerie installate."""
+    return ["CSV", "XLSX"] if _openpyxl() is not None else ["CSV"]
+
+
+def months_between(start: date, end: date):
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def _in_range(df: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    d = df["date"]
+    return df[(d >= pd.Timestamp(start)) & (d <= pd.Timestamp(end))]
+
+
+def ledger(store: Store, start: date, end: date):
+    """
+    Per ogni mese del periodo (anche vuoto): (anno, mese, righe, subtotale).
+    Le righe sono tuple nell'ordine di HEADER, per data; il subtotale è
+    (minuti, importo, importo non pagato).
+    """
+    index = store.derived("student_index", ("students",), StudentIndex)
+    pay = store.load("payments")
+    # mesi di lezioni pagati: pochi, si tengono in un set
+    paid_months = set(zip(pay["student_id"], pay["year"], pay["month"]))
+
+    for y, m in months_between(start, end):
+        les = _in_range(store.month("lessons", y, m), start, end)
+        summ = _in_range(store.month("summaries", y, m), start, end)
+        rows = []
+        # un mese ha poche righe e molte categorie (tutti gli studenti):
+        # lookup per riga invece di map() sulle categorie
+        for d, sid, minutes, amount in zip(
+            les["date"], les["student_id"], les["duration_min"], les["amount"]
+        ):
+            rows.append((d.date(), "Lezione", index.name(sid), "",
+                         None if pd.isna(minutes) else int(minutes), float(amount),
+                         (sid, y, m) in paid_months))
+        for d, sid, title, price, paid in zip(
+            summ["date"], summ["student_id"], summ["title"], summ["price"], summ["paid"]
+        ):
+            rows.append((d.date(), "Riassunto", index.name(sid), str(title), None, float(price), bool(paid)))
+        rows.sort(key=lambda r: (r[0], r[1], r[2]))
+        minutes = sum(r[4] or 0 for r in rows)
+        amount = sum(r[5] for r in rows)
+        unpaid = sum(r[5] for r in rows if not r[6])
+        yield y, m, rows, (minutes, amount, unpaid)
+
+
+def _yes(flag) -> str:
+    return "sì" if flag else "no"
+
+
+def csv_chunks(blocks, chunk_rows: int = CSV_CHUNK_ROWS):
+    """Il registro in CSV (UTF-8 con BOM, per Excel) come blocchi di bytes."""
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    buf.write("\ufeff")
+    out.writerow(HEADER)
+    pending = 0
+    minutes = amount = unpaid = 0
+    for y, m, rows, (mins, amt, unp) in blocks:
+        for d, kind, name, descr, dur, value, paid in rows:
+            out.writerow((d.isoformat(), kind, name, descr, "" if dur is None else dur,
+                          f"{value:.2f}", _yes(paid)))
+        out.writerow(("", f"Totale {m:02d}/{y}", "", f"non pagato {unp:.2f}", mins, f"{amt:.2f}", ""))
+        minutes, amount, unpaid = minutes + mins, amount + amt, unpaid + unp
+        pending += len(rows) + 1
+        if pending >= chunk_rows:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    out.writerow(("", "Totale periodo", "", f"non pagato {unpaid:.2f}", minutes, f"{amount:.2f}", ""))
+    yield buf.getvalue().encode("utf-8")
+
+
+def write_csv(f, blocks):
+    for chunk in csv_chunks(blocks):
+        f.write(chunk)
+
+
+def write_xlsx(f, blocks):
+    """Il registro in un foglio XLSX scritto in streaming (openpyxl write_only)."""
+    openpyxl = _openpyxl()
+    if openpyxl is None:
+        raise RuntimeError("Serve openpyxl per l'export XLSX: pip install openpyxl")
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Registro")
+    bold = Font(bold=True)
+
+    def bold_row(values):
+        cells = []
+        for i, value in enumerate(values):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = bold
+            if i == 5:
+                cell.number_format = "0.00"
+            cells.append(cell)
+        return cells
+
+    def total_row(label, descr, mins, amt):
+        return bold_row((None, label, None, descr, mins, amt, None))
+
+    ws.append(bold_row(HEADER))
+    minutes = amount = unpaid = 0
+    for y, m, rows, (mins, amt, unp) in blocks:
+        for d, kind, name, descr, dur, value, paid in rows:
+            day = WriteOnlyCell(ws, value=d)
+            day.number_format = "DD/MM/YYYY"
+            money = WriteOnlyCell(ws, value=value)
+            money.number_format = "0.00"
+            ws.append([day, kind, name, descr, dur, money, _yes(paid)])
+        ws.append(total_row(f"Totale {m:02d}/{y}", f"non pagato {unp:.2f}", mins, amt))
+        minutes, amount, unpaid = minutes + mins, amount + amt, unpaid + unp
+    ws.append(total_row("Totale periodo", f"non pagato {unpaid:.2f}", minutes, amount))
+    wb.save(f)
+
+
+WRITERS = {"CSV": write_csv, "XLSX": write_xlsx}
+MIME = {
+    "CSV": "text/csv",
+    "XLSX": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export(store: Store, start: date, end: date, fmt: str, f, progress=None):
+    """
+    Scrive in f (binario) il registro del periodo nel formato fmt;
+    progress(mesi fatti, mesi totali), se data, è chiamata dopo ogni mese.
+    """
+    blocks = ledger(store, start, end)
+    if progress is not None:
+        total = sum(1 for _ in months_between(start, end))
+        blocks = _counted(blocks, total, progress)
+    WRITERS[fmt](f, blocks)
+
+
+def _counted(blocks, total, progress):
+    for done, block in enumerate(blocks, 1):
+        yield block
+        progress(done, total)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and not args[0][:1].isdigit():
+        data_dir = Path(args.pop(0))
+    else:
+        data_dir = Path(__file__).parent
+    if len(args) not in (2, 3):
+        sys.exit("uso: python ledger.py [cartella_dati] DAL AL [registro.csv|.xlsx]")
+    start, end = (date.fromisoformat(a) for a in args[:2])
+    store = Store(data_dir, make_engine(data_dir))
+    if len(args) == 2:
+        export(store, start, end, "CSV", sys.stdout.buffer)
+    else:
+        out = Path(args[2])
+        with open(out, "wb") as f:
+            export(store, start, end, "XLSX" if out.suffix.lower() == ".xlsx" else "CSV", f)
@@ -0,0 +1,180 @@
+"""
+Strumentazione dei rerun: tempo per fase, byte letti/scritti per file e
+numero di widget creati.
+
+Si attiva con TUTOR_METRICS=1. Da spenta phase() restituisce un context
+manager vuoto e count_io() esce subito, quindi il costo è trascurabile.
+
+Ogni run (start_run ... finish) produce un record che finisce nel log
+"tutor.metrics" come riga JSON e che l'app mostra nel pannello admin.
+Un run che non arriva a finish() (st.rerun() dopo una scrittura, st.stop())
+viene chiuso dal start_run successivo, con la durata fino all'ultima
+misura e "ended": "interrotto". I rerun dei soli fragment hanno un record
+proprio (vedi run()).
+I record aperti sono indicizzati per sessione Streamlit (per thread fuori
+da Streamlit): un rerun può partire su un thread nuovo, e i rerun di
+sessioni diverse non si mescolano.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+ENABLED = os.environ.get("TUTOR_METRICS", "").lower() not in ("", "0", "false", "no")
+
+log = logging.getLogger("tutor.metrics")
+if ENABLED and not log.handlers:
+    # una riga JSON per run su stderr, senza i prefissi del logging
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+_runs = {}
+_runs_lock = threading.Lock()
+# record aperti al massimo (sessioni chiuse con un run interrotto)
+MAX_OPEN = 1000
+_NULL = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("run", "name", "t0")
+
+    def __init__(self, run, name):
+        self.run, self.name = run, name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        phases = self.run["phases"]
+        phases[self.name] = phases.get(self.name, 0.0) + now - self.t0
+        self.run["end"] = now
+
+
+def _key():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return threading.get_ident()
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return threading.get_ident() if ctx is None else ctx.session_id
+
+
+def _current():
+    if not ENABLED:
+        return None
+    return _runs.get(_key())
+
+
+def active() -> bool:
+    return _current() is not None
+
+
+def start_run(**info):
+    """
+    Inizia il record del rerun corrente (info: pagina, tenant, ...); chiude
+    prima quello del run precedente, se è stato interrotto.
+    """
+    if not ENABLED:
+        return
+    pending = _current()
+    if pending is not None:
+        _emit(pending, ended="interrotto", widgets=None)
+    now = time.perf_counter()
+    with _runs_lock:
+        while len(_runs) >= MAX_OPEN:
+            _runs.pop(next(iter(_runs)))
+        _runs[_key()] = {"info": info, "phases": {}, "io": {}, "t0": now, "lap": now, "end": now}
+
+
+@contextmanager
+def run(**info):
+    """
+    Record di un rerun parziale (fragment): se un run è già aperto le misure
+    vanno in quello, altrimenti se ne apre uno chiuso anche se il fragment
+    termina con st.rerun().
+    """
+    if not ENABLED or _current() is not None:
+        yield
+        return
+    start_run(**info)
+    try:
+        yield
+    finally:
+        finish()
+
+
+def phase(name: str):
+    """Context manager che somma il tempo trascorso alla fase `name`."""
+    run = _current()
+    return _NULL if run is None else _Phase(run, name)
+
+
+def lap(name: str):
+    """Assegna a `name` il tempo trascorso dall'ultimo lap (o dall'inizio)."""
+    run = _current()
+    if run is None:
+        return
+    now = time.perf_counter()
+    run["phases"][name] = run["phases"].get(name, 0.0) + now - run["lap"]
+    run["lap"] = run["end"] = now
+
+
+def count_io(path, read: int = 0, written: int = 0):
+    run = _current()
+    if run is None:
+        return
+    cell = run["io"].setdefault(Path(path).name, {"read": 0, "written": 0})
+    cell["read"] += read
+    cell["written"] += written
+    run["end"] = time.perf_counter()
+
+
+def widget_count():
+    """Widget registrati nel run corrente di Streamlit (None se non disponibile)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return None
+    # la posizione del set è cambiata fra le versioni di Streamlit
+    ids = getattr(getattr(ctx, "shared", None), "widget_ids_this_run", None)
+    if ids is None:
+        ids = getattr(ctx, "widget_ids_this_run", None)
+    if ids is None:
+        return None
+    # nelle versioni recenti è un ThreadSafeSet, senza len()
+    return len(ids.snapshot() if hasattr(ids, "snapshot") else ids)
+
+
+def finish():
+    """Chiude il record del run, lo scrive nel log come JSON e lo restituisce."""
+    run = _current()
+    if run is None:
+        return None
+    run["end"] = time.perf_counter()
+    return _emit(run, ended="completo", widgets=widget_count())
+
+
+def _emit(run, ended, widgets):
+    with _runs_lock:
+        for key in [k for k, v in _runs.items() if v is run]:
+            del _runs[key]
+    record = {
+        **run["info"],
+        "ended": ended,
+        "total_ms": round((run["end"] - run["t0"]) * 1000, 2),
+        "phases_ms": {k: round(v * 1000, 2) for k, v in run["phases"].items()},
+        "io_bytes": run["io"],
+        "widgets": widgets,
+    }
+    log.info(json.dumps(record, ensure_ascii=False))
+    return record
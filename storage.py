@@ -0,0 +1,1198 @@
+"""
+Persistenza delle tabelle del Tutor Manager.
+
+Ogni tabella (students, lessons, summaries, payments, day_checks) è descritta
+da SCHEMA/KEYS e salvata da un "engine":
+
+- CsvEngine: un file CSV per tabella, riscritto a ogni modifica (default);
+- JournalEngine: CSV come snapshot più un journal append-only per tabella,
+  compattato nel CSV quando supera una soglia;
+- SqliteEngine: un unico database indicizzato, con insert/update/delete
+  per singola riga.
+
+L'app passa sempre da uno Store, che tiene allineati i DataFrame in memoria
+e l'engine scelto (variabile d'ambiente TUTOR_STORAGE=csv|journal|sqlite). Lo Store
+è condiviso fra le sessioni e tiene in cache le tabelle già lette, valide
+finché la "versione" dell'engine (mtime/dimensione del file per i CSV) non
+cambia. I tipi di SCHEMA (date datetime64, id categorici, interi compatti,
+booleani) vengono applicati una volta sola, al caricamento.
+
+Le scritture sono serializzate anche fra processi da un lock su file
+(.tutor.lock nella cartella dati); i CSV sono scritti in un file temporaneo,
+sincronizzati su disco e sostituiti con un rename atomico. Prima di scrivere
+lo Store controlla che la tabella su disco sia ancora quella che ha in
+memoria: se un altro processo l'ha modificata solleva StaleDataError e la
+ricarica, invece di sovrascrivere i dati più recenti.
+
+I mesi chiusi di lessons possono essere spostati in un archivio di file
+Parquet immutabili, uno per mese (richiede pyarrow). I riassunti restano
+fra le righe aperte: pagato e autore cambiano anche a mese chiuso.
+
+    python storage.py close-months [cartella_dati] [AAAA-MM]
+
+chiude tutti i mesi precedenti ad AAAA-MM (default: il mese corrente). Le
+tabelle "calde" restano piccole; Store.month() legge solo la partizione del
+mese richiesto e Store.history() unisce righe aperte e archivio.
+
+open_store() tiene in memoria uno Store per cartella dati (un tutor), con
+politica LRU: al massimo TUTOR_MAX_STORES Store attivi.
+
+Import una tantum dei CSV esistenti in SQLite:
+
+    python storage.py import-csv [cartella_dati]
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger("tutor.storage")
+
+TABLES = ("students", "lessons", "summaries", "payments", "day_checks")
+
+# Tipo di ogni colonna: "str", "category", "date", "bool" o un dtype numerico
+SCHEMA = {
+    "students": {
+        "id": "str", "name": "str", "hourly_rate": "float64", "note": "str",
+    },
+    "lessons": {
+        "id": "str", "student_id": "category", "date": "date",
+        "duration_min": "Int32", "amount": "float64",
+    },
+    "summaries": {
+        "id": "str", "student_id": "category", "date": "date", "release_date": "date",
+        "title": "str", "price": "float64", "author": "str", "paid": "bool",
+    },
+    "payments": {
+        "student_id": "category", "year": "Int16", "month": "Int8",
+    },
+    "day_checks": {
+        "date": "date", "checked": "bool",
+    },
+}
+
+# Valori usati al posto dei mancanti
+DEFAULTS = {
+    "students":  {"note": ""},
+    "summaries": {"author": "C", "paid": False},
+    "day_checks": {"checked": False},
+}
+
+COLUMNS = {table: list(cols) for table, cols in SCHEMA.items()}
+
+# Colonne che identificano una riga (usate da update/delete)
+KEYS = {
+    "students":  ["id"],
+    "lessons":   ["id"],
+    "summaries": ["id"],
+    "payments":  ["student_id", "year", "month"],
+    "day_checks": ["date"],
+}
+
+# Tabelle in cui le righe con chiave ripetuta sono scartate al caricamento
+# (un pagamento registrato due volte vale uno)
+DEDUP_ON_LOAD = ("payments",)
+
+# Tabelle figlie, con la colonna che punta al padre (cancellazione a cascata)
+CHILDREN = {
+    "students": [("lessons", "student_id"), ("summaries", "student_id"),
+                 ("payments", "student_id")],
+}
+
+TEXT_KINDS = ("str", "category", "date")
+
+
+def _sql_type(kind: str) -> str:
+    if kind in TEXT_KINDS:
+        return "TEXT"
+    if kind == "bool" or kind.startswith("Int"):
+        return "INTEGER"
+    return "REAL"
+
+
+SQL_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_lessons_student ON lessons(student_id)",
+    "CREATE INDEX IF NOT EXISTS ix_lessons_date ON lessons(date)",
+    "CREATE INDEX IF NOT EXISTS ix_summaries_student ON summaries(student_id)",
+    "CREATE INDEX IF NOT EXISTS ix_summaries_date ON summaries(date)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_month ON payments(year, month)",
+]
+
+DB_NAME = "tutor.db"
+LOCK_NAME = ".tutor.lock"
+
+# Oltre questa dimensione il journal viene compattato nel CSV
+JOURNAL_MAX_BYTES = int(os.environ.get("TUTOR_JOURNAL_MAX_BYTES", 64 * 1024))
+
+
+def table_files(root: Path) -> dict:
+    return {t: Path(root) / f"{t}.csv" for t in TABLES}
+
+
+def load_csv(path: Path, cols: list, dtype: dict = None):
+    if path.exists():
+        metrics.count_io(path, read=path.stat().st_size)
+        df = pd.read_csv(path, dtype=dtype)
+        df = df[[c for c in df.columns if c in cols]]
+        for col in cols:
+            if col not in df.columns:
+                df[col] = pd.NA
+        return df[cols]
+    return pd.DataFrame(columns=cols)
+
+
+def save_csv(df: pd.DataFrame, path: Path):
+    """Scrittura atomica: file temporaneo, fsync, rename sul file finale."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            df.to_csv(f, index=False, date_format="%Y-%m-%d")
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.count_io(path, written=f.tell())
+        # mkstemp crea il file con permessi 0600: teniamo quelli di prima
+        os.chmod(tmp, path.stat().st_mode if path.exists() else 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+def _fsync_dir(path: Path):
+    # rende persistente il rename; non supportato su Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Lock esclusivo fra processi sul file `path` (creato se manca)."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class StaleDataError(RuntimeError):
+    """La tabella è stata modificata da un altro processo dopo la lettura."""
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    try:
+        if pd.isna(value):
+            return False
+    except (TypeError, ValueError):
+        pass
+    return bool(value)
+
+
+def apply_schema(table: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Converte le colonne di df nei tipi di SCHEMA (una volta, al caricamento)."""
+    defaults = DEFAULTS.get(table, {})
+    for col, kind in SCHEMA[table].items():
+        s = df[col]
+        if col in defaults:
+            s = s.fillna(defaults[col])
+        if kind == "date":
+            s = pd.to_datetime(s, errors="coerce", format="ISO8601")
+        elif kind == "bool":
+            s = s if s.dtype == bool else s.map(_to_bool).astype(bool)
+        elif kind == "category":
+            s = s.astype("category")
+        elif kind != "str":
+            s = pd.to_numeric(s, errors="coerce")
+            s = s.round().astype(kind) if kind.startswith("Int") else s.astype(kind)
+        df[col] = s
+    return df
+
+
+def coerce_values(table: str, df: pd.DataFrame, values: dict) -> dict:
+    """
+    Porta i valori di una riga nei tipi di SCHEMA; per le colonne categoriche
+    aggiunge a df le categorie nuove, così l'assegnazione non fallisce.
+    """
+    defaults = DEFAULTS.get(table, {})
+    out = {}
+    for col, val in values.items():
+        kind = SCHEMA[table][col]
+        if val is None or (not isinstance(val, str) and pd.isna(val)):
+            val = defaults.get(col)
+        if kind == "date":
+            val = pd.to_datetime(val, errors="coerce")
+        elif kind == "bool":
+            val = _to_bool(val)
+        elif val is None:
+            val = pd.NA if kind != "str" else val
+        elif kind == "category":
+            if val not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([val])
+        elif kind.startswith("Int"):
+            val = int(round(float(val)))
+        elif kind != "str":
+            val = float(val)
+        out[col] = val
+    return out
+
+
+def _plain(value):
+    """Converte scalari numpy/pandas in tipi Python (NA -> None, date ISO)."""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    if hasattr(value, "item"):
+        value = value.item()
+    return value
+
+
+def _py(value):
+    """Come _plain, ma con i booleani come interi per sqlite3."""
+    value = _plain(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _key_mask(df: pd.DataFrame, key: dict):
+    mask = pd.Series(True, index=df.index)
+    for col, val in key.items():
+        mask &= df[col] == val
+    return mask
+
+
+# ───────────────────────────── ENGINE CSV ──────────────────────────────
+class CsvEngine:
+    name = "csv"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.files = table_files(self.root)
+
+    def version(self, table: str):
+        try:
+            st = self.files[table].stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, table: str) -> pd.DataFrame:
+        # id, testi e date restano stringhe (un id "8833181" non diventa un int)
+        text = {c: str for c, kind in SCHEMA[table].items() if kind in TEXT_KINDS}
+        return load_csv(self.files[table], COLUMNS[table], dtype=text)
+
+    def save(self, table: str, df: pd.DataFrame):
+        save_csv(df, self.files[table])
+
+    # Con i CSV ogni modifica riscrive il file: df è già aggiornato in memoria.
+    def insert(self, table, df, row):
+        self.save(table, df)
+
+    def update(self, table, df, key, values):
+        self.save(table, df)
+
+    def delete(self, table, df, keys):
+        self.save(table, df)
+
+    def delete_many(self, batch):
+        """
+        batch: lista di (table, df, keys). Con i file non c'è una transazione
+        fra tabelle: si scrive nell'ordine dato (prima le figlie, poi il padre),
+        così un'interruzione lascia al più un padre da cancellare di nuovo.
+        """
+        for table, df, keys in batch:
+            if keys:
+                self.delete(table, df, keys)
+
+    def close(self):
+        pass
+
+
+# ─────────────────────────── ENGINE JOURNAL ────────────────────────────
+class JournalEngine(CsvEngine):
+    """
+    Ogni insert/update/delete aggiunge una riga JSON a <tabella>.journal,
+    quindi una scrittura costa pochi byte qualunque sia la storia.
+    Al caricamento il journal viene riapplicato sullo snapshot CSV; quando
+    supera JOURNAL_MAX_BYTES lo stato completo viene riscritto nel CSV e il
+    journal svuotato.
+
+    Il replay è idempotente (un insert con chiave già presente viene
+    ignorato), così un crash durante la compattazione non duplica righe;
+    le righe troncate da un crash durante un'aggiunta vengono saltate.
+    """
+    name = "journal"
+
+    def __init__(self, root: Path, max_bytes: int = JOURNAL_MAX_BYTES):
+        super().__init__(root)
+        self.max_bytes = max_bytes
+        self.journals = {t: p.with_suffix(".journal") for t, p in self.files.items()}
+
+    def version(self, table: str):
+        try:
+            st = self.journals[table].stat()
+            journal = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            journal = None
+        return (super().version(table), journal)
+
+    def load(self, table: str) -> pd.DataFrame:
+        df = super().load(table)
+        path = self.journals[table]
+        if not path.exists():
+            return df
+        metrics.count_io(path, read=path.stat().st_size)
+        return self._replay(table, df, path)
+
+    def _replay(self, table: str, df: pd.DataFrame, path: Path) -> pd.DataFrame:
+        cols, key_cols = COLUMNS[table], KEYS[table]
+        seen = set(df[key_cols].itertuples(index=False, name=None))
+        pending = []
+
+        def flush(df):
+            if not pending:
+                return df
+            new = pd.DataFrame(pending, columns=cols)
+            pending.clear()
+            return new if df.empty else pd.concat([df, new], ignore_index=True)
+
+        # errors="replace": un carattere spezzato a metà non blocca la lettura
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # riga troncata da un crash: i record successivi valgono
+                if rec["op"] == "insert":
+                    row = rec["row"]
+                    k = tuple(row.get(c) for c in key_cols)
+                    if k not in seen:
+                        seen.add(k)
+                        pending.append(row)
+                    continue
+                df = flush(df)
+                if rec["op"] == "update":
+                    mask = _key_mask(df, rec["key"])
+                    for col, val in rec["values"].items():
+                        df.loc[mask, col] = val
+                elif rec["op"] == "delete":
+                    for key in rec["keys"]:
+                        df = df[~_key_mask(df, key)]
+                        seen.discard(tuple(key[c] for c in key_cols))
+        return flush(df).reset_index(drop=True)
+
+    def _append(self, table: str, df: pd.DataFrame, record: dict):
+        path = self.journals[table]
+        data = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with open(path, "ab+") as f:
+            # un crash a metà scrittura lascia l'ultima riga senza "\n": la si
+            # chiude, così il nuovo record non finisce attaccato a quella
+            end = f.seek(0, os.SEEK_END)
+            if end:
+                f.seek(end - 1)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        metrics.count_io(path, written=len(data))
+        if size > self.max_bytes:
+            self.save(table, df)
+
+    def save(self, table: str, df: pd.DataFrame):
+        # Compattazione: lo snapshot contiene già tutto il journal
+        super().save(table, df)
+        self.journals[table].unlink(missing_ok=True)
+
+    def insert(self, table, df, row):
+        row = {c: _plain(row.get(c)) for c in COLUMNS[table]}
+        self._append(table, df, {"op": "insert", "row": row})
+
+    def update(self, table, df, key, values):
+        self._append(table, df, {
+            "op": "update",
+            "key": {c: _plain(v) for c, v in key.items()},
+            "values": {c: _plain(v) for c, v in values.items()},
+        })
+
+    def delete(self, table, df, keys):
+        if keys:
+            self._append(table, df, {
+                "op": "delete",
+                "keys": [{c: _plain(v) for c, v in k.items()} for k in keys],
+            })
+
+
+# ──────────────────────────── ENGINE SQLITE ────────────────────────────
+class SqliteEngine:
+    name = "sqlite"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        # Streamlit serve ogni sessione in un thread: una connessione condivisa
+        # protetta da lock.
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock:
+            for table in TABLES:
+                cols = ", ".join(f"{c} {_sql_type(k)}" for c, k in SCHEMA[table].items())
+                cols += f", PRIMARY KEY ({', '.join(KEYS[table])})"
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+            # Contatore di modifiche per tabella, usato come versione dalla cache
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, n INTEGER)"
+            )
+            self._migrate_payments_key()
+            for ddl in SQL_INDEXES:
+                self.conn.execute(ddl)
+
+    def _migrate_payments_key(self):
+        # i database creati prima avevano payments senza chiave primaria
+        # (e quindi con possibili doppioni): la tabella viene ricreata
+        sql = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'payments'"
+        ).fetchone()[0]
+        if "PRIMARY KEY" in sql:
+            return
+        cols = ", ".join(COLUMNS["payments"])
+        key = ", ".join(KEYS["payments"])
+        types = ", ".join(f"{c} {_sql_type(k)}" for c, k in SCHEMA["payments"].items())
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(f"CREATE TABLE payments_new ({types}, PRIMARY KEY ({key}))")
+            self.conn.execute(f"INSERT OR IGNORE INTO payments_new SELECT {cols} FROM payments")
+            self.conn.execute("DROP TABLE payments")
+            self.conn.execute("ALTER TABLE payments_new RENAME TO payments")
+            self.conn.execute(
+                "INSERT INTO _versions (name, n) VALUES ('payments', 1) "
+                "ON CONFLICT(name) DO UPDATE SET n = n + 1"
+            )
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    @contextmanager
+    def _tx(self):
+        """Transazione esplicita (la connessione è in autocommit)."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _bump(self, table: str):
+        self.conn.execute(
+            "INSERT INTO _versions (name, n) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET n = n + 1",
+            (table,),
+        )
+
+    def version(self, table: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT n FROM _versions WHERE name = ?", (table,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return all(
+                self.conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() is None
+                for t in TABLES
+            )
+
+    def load(self, table: str) -> pd.DataFrame:
+        cols = COLUMNS[table]
+        with self.lock:
+            df = pd.read_sql_query(f"SELECT {', '.join(cols)} FROM {table}", self.conn)
+        return df[cols]
+
+    def save(self, table: str, df: pd.DataFrame):
+        cols = COLUMNS[table]
+        rows = [tuple(_py(v) for v in r) for r in df[cols].itertuples(index=False)]
+        marks = ", ".join("?" for _ in cols)
+        with self._tx():
+            self.conn.execute(f"DELETE FROM {table}")
+            self.conn.executemany(
+                f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({marks})", rows
+            )
+            self._bump(table)
+
+    def insert(self, table, df, row):
+        cols = COLUMNS[table]
+        marks = ", ".join("?" for _ in cols)
+        with self._tx():
+            self.conn.execute(
+                f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({marks})",
+                [_py(row.get(c)) for c in cols],
+            )
+            self._bump(table)
+
+    def update(self, table, df, key, values):
+        sets = ", ".join(f"{c} = ?" for c in values)
+        where = " AND ".join(f"{c} = ?" for c in key)
+        with self._tx():
+            self.conn.execute(
+                f"UPDATE {table} SET {sets} WHERE {where}",
+                [_py(v) for v in values.values()] + [_py(v) for v in key.values()],
+            )
+            self._bump(table)
+
+    def _delete(self, table, keys):
+        where = " AND ".join(f"{c} = ?" for c in KEYS[table])
+        self.conn.executemany(
+            f"DELETE FROM {table} WHERE {where}",
+            [[_py(k[c]) for c in KEYS[table]] for k in keys],
+        )
+        self._bump(table)
+
+    def delete(self, table, df, keys):
+        if not keys:
+            return
+        with self._tx():
+            self._delete(table, keys)
+
+    def delete_many(self, batch):
+        """Tutte le cancellazioni di batch in un'unica transazione."""
+        with self._tx():
+            for table, _, keys in batch:
+                if keys:
+                    self._delete(table, keys)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ─────────────────────── ARCHIVIO MESI CHIUSI ──────────────────────────
+ARCHIVED_TABLES = ("lessons",)
+ARCHIVE_DIR = "archive"
+# Partizioni mensili tenute in memoria
+PARTITION_CACHE = 24
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+    return pq
+
+
+class Archive:
+    """
+    Mesi chiusi, un file Parquet immutabile per (tabella, mese):
+    archive/<tabella>/<aaaa>-<mm>.parquet, letti con memory map e tenuti
+    in una piccola cache LRU. Senza pyarrow l'archivio non si può scrivere
+    né leggere (ma se è vuoto l'app funziona come prima).
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root) / ARCHIVE_DIR
+        self.lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._months = {}
+
+    def path(self, table: str, year: int, month: int) -> Path:
+        return self.root / table / f"{year:04d}-{month:02d}.parquet"
+
+    def months(self, table: str) -> list:
+        """(anno, mese) archiviati, in ordine; riletti solo se la cartella cambia."""
+        folder = self.root / table
+        try:
+            mtime = folder.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        hit = self._months.get(table)
+        if hit is None or hit[0] != mtime:
+            found = sorted(tuple(int(x) for x in p.stem.split("-"))
+                           for p in folder.glob("*.parquet"))
+            hit = self._months[table] = (mtime, found)
+        return hit[1]
+
+    def is_closed(self, table: str, year: int, month: int) -> bool:
+        return table in ARCHIVED_TABLES and (year, month) in self.months(table)
+
+    def read(self, table: str, year: int, month: int) -> pd.DataFrame:
+        key = (table, year, month)
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        pq = _parquet()
+        if pq is None:
+            raise RuntimeError("Serve pyarrow per leggere l'archivio dei mesi chiusi")
+        path = self.path(table, year, month)
+        metrics.count_io(path, read=path.stat().st_size)
+        df = apply_schema(table, pq.read_table(path, memory_map=True).to_pandas())
+        with self.lock:
+            self._cache[key] = df
+            while len(self._cache) > PARTITION_CACHE:
+                self._cache.popitem(last=False)
+        return df
+
+    def read_all(self, table: str, months: list) -> pd.DataFrame:
+        """Più partizioni insieme: concatenate in Arrow, convertite una volta."""
+        pq = _parquet()
+        if pq is None:
+            raise RuntimeError("Serve pyarrow per leggere l'archivio dei mesi chiusi")
+        import pyarrow as pa
+
+        tables = []
+        for y, m in months:
+            path = self.path(table, y, m)
+            metrics.count_io(path, read=path.stat().st_size)
+            tables.append(pq.read_table(path, memory_map=True))
+        return pa.concat_tables(tables, promote_options="permissive").to_pandas()
+
+    def remove(self, table: str, months: list):
+        for y, m in months:
+            self.path(table, y, m).unlink(missing_ok=True)
+        with self.lock:
+            for key in [k for k in self._cache if k[0] == table]:
+                del self._cache[key]
+
+    def write(self, table: str, year: int, month: int, df: pd.DataFrame):
+        """Scrive la partizione (file temporaneo, fsync, rename)."""
+        pq = _parquet()
+        if pq is None:
+            raise RuntimeError("Serve pyarrow per archiviare i mesi chiusi")
+        import pyarrow as pa
+
+        path = self.path(table, year, month)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        pq.write_table(pa.Table.from_pandas(df[COLUMNS[table]], preserve_index=False), tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(path.parent)
+        metrics.count_io(path, written=path.stat().st_size)
+
+
+def _uncategorized(df: pd.DataFrame) -> pd.DataFrame:
+    """Colonne categoriche convertite in oggetti, per concatenare frame con categorie diverse."""
+    cats = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    return df.astype({c: object for c in cats}) if cats else df
+
+
+def import_csv(root: Path, engine: SqliteEngine):
+    """
+    Copia nel database il contenuto attuale dei CSV (sostituisce le tabelle).
+    Le chiavi ripetute si scartano, con un avviso, solo nelle tabelle di
+    DEDUP_ON_LOAD; altrove l'import si ferma con ValueError prima di scrivere.
+    """
+    src = CsvEngine(root)
+    frames = {}
+    for table in TABLES:
+        df = src.load(table)
+        dup = df.duplicated(KEYS[table])
+        if dup.any():
+            keys = df.loc[dup, KEYS[table]].to_dict("records")
+            if table not in DEDUP_ON_LOAD:
+                raise ValueError(f"{table}: {int(dup.sum())} righe con chiave ripetuta {keys}")
+            log.warning("%s: scartate %d righe con chiave ripetuta: %s", table, int(dup.sum()), keys)
+            df = df[~dup]
+        frames[table] = df
+    for table, df in frames.items():
+        engine.save(table, df)
+
+
+# ─────────────────────────────── STORE ─────────────────────────────────
+class Store:
+    """
+    Punto di accesso unico alle tabelle: carica i DataFrame e applica
+    le modifiche sia in memoria sia sull'engine.
+
+    Le tabelle lette restano in cache insieme alla versione dell'engine da
+    cui provengono; dopo ogni scrittura la voce viene aggiornata con il
+    DataFrame appena salvato, senza rileggere nulla.
+
+    Ogni scrittura avviene sotto il lock su file della cartella dati e solo
+    se il DataFrame passato è quello in cache e la versione su disco non è
+    cambiata; altrimenti la tabella viene tolta dalla cache e si solleva
+    StaleDataError: al rerun la sessione rilegge i dati aggiornati.
+
+    labels(table, column, value) usa un indice secondario (valore -> etichette
+    di riga), costruito alla prima richiesta e aggiornato a ogni scrittura;
+    delete_cascade() lo usa per cancellare un padre con tutte le righe figlie
+    (CHILDREN) in un solo batch. Le righe dei mesi archiviati sono immutabili
+    e restano nell'archivio.
+
+    Per lessons e summaries: month() restituisce un solo mese (dall'archivio
+    se è chiuso), history() la tabella completa; gli oggetti derivati sono
+    costruiti sulla storia completa. Le partizioni di una tabella che non
+    è più in ARCHIVED_TABLES tornano fra le righe aperte al caricamento.
+
+    Gli oggetti derivati (indici, aggregati) si ottengono con derived():
+    vengono ricostruiti solo quando cambia la versione dei dati da cui
+    dipendono, oppure aggiornati sul posto se espongono
+    apply(table, op, old, new) e restituiscono True.
+    """
+
+    def __init__(self, root: Path, engine):
+        self.root = Path(root)
+        self.engine = engine
+        self.lock = threading.RLock()
+        self.lock_path = self.root / LOCK_NAME
+        self._file_locked = False
+        self._cache = {}
+        self._versions = dict.fromkeys(TABLES, 0)
+        self._derived = {}
+        self._indexes = {}
+        self._history = {}
+        self.archive = Archive(self.root)
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        file_lock() sul lock_path, rientrante: una scrittura (delete_cascade)
+        può caricare una tabella la cui migrazione salva su disco. Va usato
+        tenendo self.lock, che lo rende esclusivo fra i thread.
+        """
+        if self._file_locked:
+            yield
+            return
+        with file_lock(self.lock_path):
+            self._file_locked = True
+            try:
+                yield
+            finally:
+                self._file_locked = False
+
+    def data_version(self, table: str) -> int:
+        """Contatore che cambia a ogni nuova versione della tabella in cache."""
+        return self._versions[table]
+
+    def stamp(self, *tables) -> str:
+        """
+        Impronta breve delle versioni su disco di `tables` (archivio
+        compreso): uguale fra processi finché i dati non cambiano.
+        """
+        raw = repr([(t, self.engine.version(t), self.archive.months(t)) for t in tables])
+        return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+    def load(self, table: str) -> pd.DataFrame:
+        with self.lock:
+            version = self.engine.version(table)
+            hit = self._cache.get(table)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+            with metrics.phase(f"load {table}"):
+                df = apply_schema(table, self.engine.load(table))
+            dup = df.duplicated(KEYS[table]) if table in DEDUP_ON_LOAD else None
+            if dup is not None and dup.any():
+                # migrazione: pagamenti registrati due volte salvati una volta sola
+                log.warning("%s: scartate %d righe con chiave ripetuta: %s", table,
+                            int(dup.sum()), df.loc[dup, KEYS[table]].to_dict("records"))
+                df = df[~dup].reset_index(drop=True)
+                with self._file_lock():
+                    if self.engine.version(table) == version:
+                        self.engine.save(table, df)
+                        version = self.engine.version(table)
+            if table not in ARCHIVED_TABLES and self.archive.months(table):
+                df, version = self._unarchive(table, df, version)
+            self._cache[table] = (version, df)
+            self._drop_indexes(table)
+            self._versions[table] += 1
+            return df
+
+    def _unarchive(self, table: str, df: pd.DataFrame, version):
+        """
+        Migrazione: riporta fra le righe aperte i mesi archiviati di una
+        tabella che non si archivia più. Prima salva, poi cancella le
+        partizioni: se si interrompe, il caricamento successivo la completa.
+        """
+        months = self.archive.months(table)
+        archived = self.archive.read_all(table, months)
+        merged = apply_schema(table, pd.concat([_uncategorized(df), _uncategorized(archived)],
+                                               ignore_index=True))
+        # le righe aperte hanno la precedenza su quelle archiviate
+        merged = merged.drop_duplicates(KEYS[table]).reset_index(drop=True)
+        with self._file_lock():
+            if self.engine.version(table) != version:
+                return df, version
+            self.engine.save(table, merged)
+            self.archive.remove(table, months)
+        log.warning("%s: %d mesi tolti dall'archivio e riportati fra le righe aperte",
+                    table, len(months))
+        return merged, self.engine.version(table)
+
+    def derived(self, name: str, tables: tuple, build):
+        """Restituisce build(*tabelle), memorizzato per versione dei dati."""
+        with self.lock:
+            for t in tables:
+                self.load(t)  # aggiorna la versione se il file è cambiato
+            versions = tuple(self._versions[t] for t in tables)
+            hit = self._derived.get(name)
+            if hit is not None and hit[1] == versions:
+                return hit[2]
+            obj = build(*[self.history(t) for t in tables])
+            self._derived[name] = (tables, versions, obj)
+            return obj
+
+    def history(self, table: str) -> pd.DataFrame:
+        """Righe aperte più i mesi archiviati (sola lettura)."""
+        with self.lock:
+            df = self.load(table)
+            months = self.archive.months(table) if table in ARCHIVED_TABLES else []
+            if not months:
+                return df
+            key = (self._versions[table], tuple(months))
+            hit = self._history.get(table)
+            if hit is not None and hit[0] == key:
+                return hit[1]
+            archived = self.archive.read_all(table, months)
+            # le categorie dell'archivio sono quelle del giorno di chiusura:
+            # si concatena in testo semplice e si applica lo schema una volta
+            full = apply_schema(table, pd.concat([_uncategorized(archived), _uncategorized(df)],
+                                                 ignore_index=True))
+            # un'archiviazione interrotta può lasciare righe in entrambi
+            full = full.drop_duplicates(KEYS[table]).reset_index(drop=True)
+            self._history[table] = (key, full)
+            return full
+
+    def month(self, table: str, year: int, month: int) -> pd.DataFrame:
+        """
+        Righe di un mese. Se il mese è chiuso legge solo la sua partizione
+        (sola lettura); altrimenti è una fetta della tabella aperta, con le
+        stesse etichette, utilizzabile per update/delete.
+        """
+        if self.archive.is_closed(table, year, month):
+            return self.archive.read(table, year, month)
+        df = self.load(table)
+        dt = df["date"].dt
+        return df[(dt.year == year) & (dt.month == month)]
+
+    def _check_open(self, table: str, values: dict):
+        if table not in ARCHIVED_TABLES or values.get("date") is None or pd.isna(values["date"]):
+            return
+        d = values["date"]
+        if self.archive.is_closed(table, d.year, d.month):
+            raise ValueError(f"{table}: il mese {d.year}-{d.month:02d} è chiuso (archiviato)")
+
+    def close_months(self, table: str, before: tuple) -> list:
+        """
+        Sposta nell'archivio i mesi di `table` precedenti a before=(anno, mese).
+        Prima scrive le partizioni, poi salva la tabella senza quelle righe:
+        se si interrompe, rilanciarla completa il lavoro.
+        """
+        if table not in ARCHIVED_TABLES:
+            raise ValueError(f"{table}: tabella non archiviabile")
+        df = self.load(table)
+        dt = df["date"].dt
+        closed = (dt.year * 100 + dt.month) < before[0] * 100 + before[1]
+        done = []
+        for (y, m), part in df[closed].groupby([dt.year[closed], dt.month[closed]]):
+            y, m = int(y), int(m)
+            if self.archive.is_closed(table, y, m):
+                archived = set(self.archive.read(table, y, m)[KEYS[table][0]])
+                if not set(part[KEYS[table][0]]) <= archived:
+                    raise ValueError(f"{table}: {y}-{m:02d} è già archiviato con righe diverse")
+            else:
+                self.archive.write(table, y, m, part)
+            done.append((y, m))
+        if done:
+            self.save(table, df[~closed].reset_index(drop=True), base=df)
+        return done
+
+    def labels(self, table: str, column, value) -> list:
+        """
+        Etichette delle righe di `table` con column == value; column può
+        essere una lista di colonne e value la tupla corrispondente.
+        """
+        cols = (column,) if isinstance(column, str) else tuple(column)
+        with self.lock:
+            df = self.load(table)
+            idx = self._indexes.get((table, cols))
+            if idx is None:
+                by = cols[0] if len(cols) == 1 else list(cols)
+                groups = df.groupby(by, observed=True, sort=False).indices
+                idx = {v: set(df.index[pos]) for v, pos in groups.items()}
+                self._indexes[(table, cols)] = idx
+            return sorted(idx.get(value if len(cols) == 1 else tuple(value), ()))
+
+    def _drop_indexes(self, table: str):
+        for key in [k for k in self._indexes if k[0] == table]:
+            del self._indexes[key]
+
+    def _index_rows(self, table: str, label, old, new):
+        def value(row, cols):
+            return row[cols[0]] if len(cols) == 1 else tuple(row[c] for c in cols)
+
+        for (t, cols), idx in self._indexes.items():
+            if t != table:
+                continue
+            if old is not None:
+                rows = idx.get(value(old, cols))
+                if rows is not None:
+                    rows.discard(label)
+                    if not rows:
+                        del idx[value(old, cols)]
+            if new is not None:
+                idx.setdefault(value(new, cols), set()).add(label)
+
+    @contextmanager
+    def _writing(self, table: str, df: pd.DataFrame = None):
+        """
+        Lock (thread e processi) per una scrittura su `table`. Con df
+        verifica prima che sia la versione corrente della tabella; se la
+        scrittura fallisce la tabella esce dalla cache.
+        """
+        with self.lock, self._file_lock():
+            if df is not None:
+                hit = self._cache.get(table)
+                if hit is None or hit[1] is not df or hit[0] != self.engine.version(table):
+                    self._cache.pop(table, None)
+                    self._drop_indexes(table)
+                    raise StaleDataError(f"{table}: dati modificati altrove, ricaricare")
+            try:
+                yield
+            except BaseException:
+                # il DataFrame in cache può essere già stato modificato: senza
+                # scrittura riuscita va riletto da disco (figlie comprese)
+                for t in (table, *(child for child, _ in CHILDREN.get(table, ()))):
+                    self._cache.pop(t, None)
+                    self._drop_indexes(t)
+                raise
+
+    def _stored(self, table: str, df: pd.DataFrame, changes=()):
+        before = dict(self._versions)
+        self._cache[table] = (self.engine.version(table), df)
+        self._versions[table] += 1
+        for name, (tables, versions, obj) in list(self._derived.items()):
+            if table not in tables:
+                continue
+            apply = getattr(obj, "apply", None)
+            fresh = versions == tuple(before[t] for t in tables)
+            if fresh and apply is not None and changes and all(
+                apply(table, op, old, new) for op, old, new in changes
+            ):
+                self._derived[name] = (tables, tuple(self._versions[t] for t in tables), obj)
+            else:
+                del self._derived[name]
+
+    def save(self, table: str, df: pd.DataFrame, base: pd.DataFrame = None):
+        """Sostituisce la tabella; con base, solo se base è ancora la versione corrente."""
+        with self._writing(table, base):
+            self.engine.save(table, df)
+            self._drop_indexes(table)
+            self._stored(table, df)
+
+    def insert(self, table: str, df: pd.DataFrame, row: dict):
+        with self._writing(table, df):
+            row = coerce_values(table, df, {c: row.get(c) for c in COLUMNS[table]})
+            self._check_open(table, row)
+            key = tuple(row[c] for c in KEYS[table])
+            if self.labels(table, KEYS[table], key[0] if len(key) == 1 else key):
+                raise ValueError(f"{table}: chiave già presente {key}")
+            dtypes = df.dtypes.to_dict()
+            label = 0 if df.empty else df.index.max() + 1
+            df.loc[label] = row
+            # l'allargamento con .loc perde categorie e interi compatti
+            for col, dtype in dtypes.items():
+                if df[col].dtype != dtype:
+                    df[col] = df[col].astype(dtype)
+            self.engine.insert(table, df, row)
+            new = df.loc[label].to_dict()
+            self._index_rows(table, label, None, new)
+            self._stored(table, df, [("insert", None, new)])
+
+    def update(self, table: str, df: pd.DataFrame, label, values: dict):
+        with self._writing(table, df):
+            old = df.loc[label].to_dict()
+            key = {c: old[c] for c in KEYS[table]}
+            values = coerce_values(table, df, values)
+            self._check_open(table, values)
+            for col, val in values.items():
+                df.at[label, col] = val
+            self.engine.update(table, df, key, values)
+            new = df.loc[label].to_dict()
+            self._index_rows(table, label, old, new)
+            self._stored(table, df, [("update", old, new)])
+
+    def delete(self, table: str, df: pd.DataFrame, labels):
+        labels = list(labels)
+        if not labels:
+            return
+        with self._writing(table, df):
+            removed = df.loc[labels].to_dict("records")
+            keys = [{c: r[c] for c in KEYS[table]} for r in removed]
+            df.drop(index=labels, inplace=True)
+            self.engine.delete(table, df, keys)
+            for label, r in zip(labels, removed):
+                self._index_rows(table, label, r, None)
+            self._stored(table, df, [("delete", r, None) for r in removed])
+
+    def archived_children(self, table: str, parent) -> list:
+        """Tabelle figlie con righe di `parent` nei mesi chiusi (immutabili)."""
+        return [
+            child for child, col in CHILDREN.get(table, ())
+            if child in ARCHIVED_TABLES and any(
+                (self.archive.read(child, y, m)[col] == parent).any()
+                for y, m in self.archive.months(child)
+            )
+        ]
+
+    def delete_cascade(self, table: str, df: pd.DataFrame, label):
+        """
+        Cancella la riga `label` di `table` e le righe figlie (CHILDREN),
+        trovate con gli indici secondari, in un unico batch dell'engine.
+        ValueError se la riga ha figlie nei mesi chiusi: l'archivio non si
+        modifica e resterebbero righe senza padre.
+        """
+        parent = df.at[label, KEYS[table][0]]
+        archived = self.archived_children(table, parent)
+        if archived:
+            raise ValueError(f"{table}: {parent} ha righe in mesi chiusi ({', '.join(archived)})")
+        with self._writing(table, df):
+            # (tabella, df, etichette, righe); le figlie prima del padre
+            plan = []
+            for child, col in CHILDREN.get(table, ()):
+                child_df = self.load(child)
+                rows = self.labels(child, col, parent)
+                if rows:
+                    plan.append((child, child_df, rows, child_df.loc[rows].to_dict("records")))
+            plan.append((table, df, [label], df.loc[[label]].to_dict("records")))
+
+            batch = []
+            for t, frame, rows, removed in plan:
+                frame.drop(index=rows, inplace=True)
+                batch.append((t, frame, [{c: r[c] for c in KEYS[t]} for r in removed]))
+            self.engine.delete_many(batch)
+            for t, frame, rows, removed in plan:
+                for row_label, r in zip(rows, removed):
+                    self._index_rows(t, row_label, r, None)
+                self._stored(t, frame, [("delete", r, None) for r in removed])
+
+
+def make_engine(root: Path, kind: str = None):
+    kind = (kind or os.environ.get("TUTOR_STORAGE", "csv")).lower()
+    root = Path(root)
+    if kind == "sqlite":
+        engine = SqliteEngine(root / DB_NAME)
+        # due processi avviati insieme non devono importare due volte
+        with file_lock(root / LOCK_NAME):
+            if engine.is_empty() and any(p.exists() for p in table_files(root).values()):
+                import_csv(root, engine)
+        return engine
+    if kind == "csv":
+        return CsvEngine(root)
+    if kind == "journal":
+        return JournalEngine(root)
+    raise ValueError(f"Storage sconosciuto: {kind}")
+
+
+# Store tenuti in memoria (uno per cartella dati / tutor)
+MAX_STORES = int(os.environ.get("TUTOR_MAX_STORES", 8))
+
+_stores = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def open_store(root: Path) -> Store:
+    """
+    Restituisce lo Store (condiviso fra sessioni) della cartella dati.
+
+    Restano in memoria gli ultimi MAX_STORES usati: il meno recente viene
+    dimenticato, ma il suo engine (connessione SQLite compresa) si chiude
+    solo quando nessuno lo usa più, perché un fragment o un lavoro in
+    background può avere ancora in mano lo Store. Un nuovo Store sulla
+    stessa cartella ricarica i dati da disco.
+    """
+    root = Path(root).resolve()
+    with _stores_lock:
+        if root in _stores:
+            _stores.move_to_end(root)
+            return _stores[root]
+        _stores[root] = Store(root, make_engine(root))
+        while len(_stores) > MAX_STORES:
+            _, old = _stores.popitem(last=False)
+            weakref.finalize(old, old.engine.close)
+        return _stores[root]
+
+
+USAGE = (
+    "uso: python storage.py import-csv [cartella_dati]\n"
+    "     python storage.py close-months [cartella_dati] [AAAA-MM]"
+)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("import-csv", "close-months"):
+        sys.exit(USAGE)
+    data_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(__file__).parent
+    if sys.argv[1] == "import-csv":
+        db = SqliteEngine(data_dir / DB_NAME)
+        try:
+            import_csv(data_dir, db)
+        except ValueError as exc:
+            sys.exit(f"Import annullato: {exc}")
+        print(f"Importati {len(TABLES)} CSV in {db.path}")
+    else:
+        if _parquet() is None:
+            sys.exit("Serve pyarrow: pip install pyarrow")
+        if len(sys.argv) > 3:
+            y, m = sys.argv[3].split("-")
+            before = (int(y), int(m))
+        else:
+            today = pd.Timestamp.today()
+            before = (today.year, today.month)
+        store = Store(data_dir, make_engine(data_dir))
+        for table in ARCHIVED_TABLES:
+            months = store.close_months(table, before)
+            print(f"{table}: archiviati {len(months)} mesi "
+                  + ", ".join(f"{y}-{m:02d}" for y, m in months))
@@ -0,0 +1,62 @@
+"""
+Tutor (tenant) serviti dallo stesso processo.
+
+L'elenco sta in tenants.json accanto ad app.py (o nel file indicato dalla
+variabile d'ambiente TUTOR_TENANTS):
+
+    {
+      "chiara": {"password": "180217", "root": "data/chiara",
+                 "welcome": "Benvenuta Chiara", "invoice_url": "https://..."},
+      "marco":  {"password": "...", "root": "data/marco"}
+    }
+
+"root" è la cartella dati del tutor (relativa al file se non assoluta).
+Senza tenants.json c'è un solo tutor, "default", con i dati accanto ad app.py.
+"""
+import hmac
+import json
+import os
+from pathlib import Path
+
+DEFAULT_TENANT = "default"
+DEFAULT_PASSWORD = "180217"
+DEFAULT_WELCOME = "Benvenuta Chiara"
+
+
+def tenants_file(app_dir: Path) -> Path:
+    return Path(os.environ.get("TUTOR_TENANTS", Path(app_dir) / "tenants.json"))
+
+
+def load_tenants(app_dir: Path) -> dict:
+    """tenant id -> configurazione, con "root" già risolta."""
+    path = tenants_file(app_dir)
+    if not path.exists():
+        return {DEFAULT_TENANT: {
+            "password": DEFAULT_PASSWORD, "root": Path(app_dir), "welcome": DEFAULT_WELCOME,
+        }}
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    tenants = {}
+    for tid, conf in raw.items():
+        # il login confronta l'utente in minuscolo
+        tid = tid.strip().lower()
+        conf = dict(conf)
+        conf["root"] = (path.parent / conf.get("root", tid)).resolve()
+        conf.setdefault("welcome", f"Benvenuto/a {tid}")
+        tenants[tid] = conf
+    return tenants
+
+
+def is_multi(tenants: dict) -> bool:
+    return list(tenants) != [DEFAULT_TENANT]
+
+
+def authenticate(tenants: dict, user: str, password: str):
+    """Id del tenant se user/password sono corretti, altrimenti None."""
+    if not is_multi(tenants):
+        user = DEFAULT_TENANT
+    conf = tenants.get((user or "").strip().lower())
+    if conf is None or not hmac.compare_digest(str(conf["password"]), password or ""):
+        return None
+    Path(conf["root"]).mkdir(parents=True, exist_ok=True)
+    return user.strip().lower()
@@ -0,0 +1,70 @@
+import base64
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import storage  # noqa: E402
+from api import ApiServer  # noqa: E402
+from storage import COLUMNS, TABLES, open_store, save_csv, table_files  # noqa: E402
+from tenants import load_tenants  # noqa: E402
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setenv("TUTOR_STORAGE", "csv")
+    monkeypatch.setattr(storage, "_stores", storage.OrderedDict())
+    monkeypatch.setenv("TUTOR_TENANTS", str(tmp_path / "tenants.json"))
+    (tmp_path / "tenants.json").write_text(
+        json.dumps({"bea": {"password": "segreta", "root": "bea"}}), encoding="utf-8")
+    root = tmp_path / "bea"
+    root.mkdir()
+    files = table_files(root)
+    for table in TABLES:
+        save_csv(pd.DataFrame(columns=COLUMNS[table]), files[table])
+
+    server = ApiServer(("127.0.0.1", 0), load_tenants(tmp_path))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", root
+    server.shutdown()
+    server.server_close()
+
+
+def _get(url, password="segreta", **headers):
+    auth = base64.b64encode(f"bea:{password}".encode()).decode()
+    req = urllib.request.Request(url, headers={"Authorization": f"Basic {auth}", **headers})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, resp.headers.get("ETag"), resp.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers.get("ETag"), exc.read()
+
+
+def test_etag_gives_304_until_the_data_changes(api):
+    base, root = api
+    status, etag, body = _get(f"{base}/students")
+    assert status == 200 and etag and json.loads(body) == []
+
+    status, again, body = _get(f"{base}/students", **{"If-None-Match": etag})
+    assert (status, again, body) == (304, etag, b"")
+
+    store = open_store(root)
+    store.insert("students", store.load("students"),
+                 {"id": "s1", "name": "ANNA", "hourly_rate": 20.0, "note": ""})
+    status, changed, body = _get(f"{base}/students", **{"If-None-Match": etag})
+    assert status == 200 and changed != etag
+    assert [s["id"] for s in json.loads(body)] == ["s1"]
+
+
+def test_requests_need_valid_credentials_and_paths(api):
+    base, _ = api
+    assert _get(f"{base}/students", password="sbagliata")[0] == 401
+    assert _get(f"{base}/lessons/2025-13")[0] == 400
+    assert _get(f"{base}/nulla")[0] == 404
@@ -0,0 +1,60 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from jobs import DONE, FAILED, JobRunner  # noqa: E402
+
+
+def _wait(runner, key, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        job = runner.get(key)
+        if job["status"] in (DONE, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"{key} non finito")
+
+
+def test_same_key_runs_once_and_keeps_the_result(tmp_path):
+    release, calls = threading.Event(), []
+
+    def work(out, text, progress=None):
+        calls.append(text)
+        release.wait(5)
+        progress(1, 1)
+        out.write(text.encode())
+
+    runner = JobRunner(tmp_path)
+    first = runner.submit("k", "prova", work, "ciao")
+    second = runner.submit("k", "prova", work, "ciao")
+    assert second["created"] == first["created"]
+    release.set()
+
+    job = _wait(runner, "k")
+    assert (job["status"], job["done"], job["total"]) == (DONE, 1, 1)
+    assert runner.result_path(job).read_bytes() == b"ciao"
+    # completato e con il risultato su disco: non si rifà
+    assert runner.submit("k", "prova", work, "ciao")["status"] == DONE
+    assert calls == ["ciao"]
+    runner.close()
+
+    # un altro processo (qui un altro runner) vede lavoro e risultato
+    again = JobRunner(tmp_path)
+    assert again.result_path(again.get("k")).read_bytes() == b"ciao"
+    again.close()
+
+
+def test_failed_job_records_the_error(tmp_path):
+    def broken(out, progress=None):
+        raise RuntimeError("rotto")
+
+    runner = JobRunner(tmp_path)
+    runner.submit("k", "prova", broken)
+    job = _wait(runner, "k")
+    assert job["status"] == FAILED and job["error"] == "RuntimeError: rotto"
+    assert runner.result_path(job) is None
+    assert not list((tmp_path / "jobs").glob(".*.tmp"))
+    runner.close()
@@ -0,0 +1,221 @@
+import gc
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import storage  # noqa: E402
+from indexes import MonthlyRollup  # noqa: E402
+from storage import (  # noqa: E402
+    COLUMNS, TABLES, CsvEngine, JournalEngine, SqliteEngine, StaleDataError, Store, import_csv,
+    make_engine, save_csv, table_files,
+)
+
+
+def _write_tables(root: Path, **frames):
+    files = table_files(root)
+    for table in TABLES:
+        save_csv(frames.get(table, pd.DataFrame(columns=COLUMNS[table])), files[table])
+
+
+def _store(root: Path, engine=CsvEngine) -> Store:
+    return Store(root, engine(root))
+
+
+def _lesson(lid: str, day: str = "2025-05-10") -> dict:
+    return {"id": lid, "student_id": "s1", "date": day, "duration_min": 60, "amount": 20.0}
+
+
+def _label(df: pd.DataFrame, column: str, value):
+    return df.index[df[column] == value][0]
+
+
+@pytest.mark.parametrize("kind", ["csv", "journal", "sqlite"])
+def test_engine_round_trip(tmp_path, kind):
+    _write_tables(tmp_path)
+    store = Store(tmp_path, make_engine(tmp_path, kind))
+    for sid, name in (("s1", "ANNA"), ("s2", "LUCA")):
+        store.insert("students", store.load("students"),
+                     {"id": sid, "name": name, "hourly_rate": 20.0, "note": ""})
+    for lid in ("a1", "a2", "a3"):
+        store.insert("lessons", store.load("lessons"), _lesson(lid))
+    store.insert("summaries", store.load("summaries"), {
+        "id": "r1", "student_id": "s2", "date": "2025-05-12", "release_date": None,
+        "title": "Dante", "price": 12.5, "author": "C", "paid": False,
+    })
+    store.insert("payments", store.load("payments"), {"student_id": "s1", "year": 2025, "month": 5})
+    store.insert("day_checks", store.load("day_checks"), {"date": "2025-05-10", "checked": True})
+
+    lessons = store.load("lessons")
+    store.update("lessons", lessons, _label(lessons, "id", "a2"), {"duration_min": 90, "amount": 30.0})
+    store.delete("lessons", lessons, [_label(lessons, "id", "a3")])
+    summaries = store.load("summaries")
+    store.update("summaries", summaries, _label(summaries, "id", "r1"), {"paid": True})
+    students = store.load("students")
+    store.update("students", students, _label(students, "id", "s2"), {"note": "àèì"})
+
+    expected = {t: store.load(t).reset_index(drop=True) for t in TABLES}
+    store.engine.close()
+    fresh = Store(tmp_path, make_engine(tmp_path, kind))
+    for table in TABLES:
+        pd.testing.assert_frame_equal(fresh.load(table).reset_index(drop=True), expected[table],
+                                      check_dtype=False, check_categorical=False)
+    assert fresh.load("lessons").set_index("id").at["a2", "duration_min"] == 90
+    fresh.engine.close()
+
+
+def test_write_on_stale_data_raises(tmp_path):
+    _write_tables(tmp_path)
+    mine, other = _store(tmp_path), _store(tmp_path)
+    students = mine.load("students")
+    # un altro processo scrive dopo la lettura
+    other.insert("students", other.load("students"),
+                 {"id": "s1", "name": "ANNA", "hourly_rate": 20.0, "note": ""})
+    with pytest.raises(StaleDataError):
+        mine.insert("students", students,
+                    {"id": "s2", "name": "LUCA", "hourly_rate": 20.0, "note": ""})
+    # riletta, la scrittura passa e non perde quella dell'altro
+    mine.insert("students", mine.load("students"),
+                {"id": "s2", "name": "LUCA", "hourly_rate": 20.0, "note": ""})
+    assert list(_store(tmp_path).load("students")["id"]) == ["s1", "s2"]
+
+
+def test_history_keeps_students_added_after_closing(tmp_path):
+    pytest.importorskip("pyarrow")
+    _write_tables(
+        tmp_path,
+        students=pd.DataFrame({"id": ["s1", "s2"], "name": ["ANNA", "LUCA"],
+                               "hourly_rate": [20.0, 20.0], "note": ["", ""]}),
+        lessons=pd.DataFrame({
+            "id": ["l1", "l2", "l3"], "student_id": ["s1", "s2", "s1"],
+            "date": ["2025-05-10", "2025-06-11", "2025-07-01"],
+            "duration_min": [60, 60, 60], "amount": [20.0, 20.0, 20.0],
+        }),
+    )
+    store = _store(tmp_path)
+    assert store.close_months("lessons", (2025, 7)) == [(2025, 5), (2025, 6)]
+
+    # studente e lezione aggiunti dopo la chiusura
+    store.insert("students", store.load("students"),
+                 {"id": "s3", "name": "NUOVA", "hourly_rate": 25.0, "note": ""})
+    store.insert("lessons", store.load("lessons"), {
+        "id": "l4", "student_id": "s3", "date": "2025-07-02",
+        "duration_min": 60, "amount": 25.0,
+    })
+
+    # dopo un riavvio le categorie dell'archivio non contengono s3
+    fresh = _store(tmp_path)
+    history = fresh.history("lessons")
+    assert history["student_id"].notna().all()
+    assert sorted(history["id"]) == ["l1", "l2", "l3", "l4"]
+
+    rollup = fresh.derived("monthly_rollup", ("lessons", "summaries"), MonthlyRollup)
+    assert set(rollup.students(2025, 7)) == {"s1", "s3"}
+    assert rollup.month_totals(2025, 7)[0] == 45.0
+
+
+def test_journal_keeps_writes_after_a_torn_tail(tmp_path):
+    _write_tables(tmp_path)
+    store = _store(tmp_path, JournalEngine)
+    store.insert("lessons", store.load("lessons"), _lesson("a1"))
+    # crash a metà di un'aggiunta: ultima riga senza "\n"
+    journal = tmp_path / "lessons.journal"
+    with open(journal, "ab") as f:
+        f.write(b'{"op": "insert", "row": {"id": "rotta", "stud')
+
+    store = _store(tmp_path, JournalEngine)
+    store.insert("lessons", store.load("lessons"), _lesson("a2"))
+    store.insert("lessons", store.load("lessons"), _lesson("a3"))
+    assert list(store.load("lessons")["id"]) == ["a1", "a2", "a3"]
+
+    fresh = _store(tmp_path, JournalEngine)
+    assert list(fresh.load("lessons")["id"]) == ["a1", "a2", "a3"]
+
+
+def test_evicted_store_stays_usable_until_released(tmp_path, monkeypatch):
+    monkeypatch.setenv("TUTOR_STORAGE", "sqlite")
+    monkeypatch.setattr(storage, "MAX_STORES", 1)
+    monkeypatch.setattr(storage, "_stores", storage.OrderedDict())
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        _write_tables(tmp_path / name)
+
+    old = storage.open_store(tmp_path / "a")
+    storage.open_store(tmp_path / "b")
+    # un fragment o un lavoro in background ha ancora in mano il vecchio Store
+    assert old.load("students").empty
+    assert storage.open_store(tmp_path / "a") is not old
+
+    engine = old.engine
+    del old
+    gc.collect()
+    with pytest.raises(sqlite3.ProgrammingError):
+        engine.conn.execute("SELECT 1")
+
+
+def test_import_csv_dedupes_only_payments(tmp_path, caplog):
+    _write_tables(
+        tmp_path,
+        payments=pd.DataFrame({"student_id": ["s1", "s1"], "year": [2025, 2025],
+                               "month": [5, 5]}),
+    )
+    engine = SqliteEngine(tmp_path / "tutor.db")
+    import_csv(tmp_path, engine)
+    assert len(engine.load("payments")) == 1
+    assert "scartate 1 righe" in caplog.text
+
+    lessons = pd.DataFrame([_lesson("a1"), _lesson("a1", "2025-05-11")])
+    _write_tables(tmp_path, lessons=lessons)
+    with pytest.raises(ValueError, match="chiave ripetuta"):
+        import_csv(tmp_path, engine)
+    engine.close()
+
+
+def test_delete_cascade_refuses_students_with_archived_lessons(tmp_path):
+    pytest.importorskip("pyarrow")
+    _write_tables(
+        tmp_path,
+        students=pd.DataFrame({"id": ["s1", "s2"], "name": ["ANNA", "LUCA"],
+                               "hourly_rate": [20.0, 20.0], "note": ["", ""]}),
+        lessons=pd.DataFrame({
+            "id": ["l1", "l2"], "student_id": ["s1", "s2"],
+            "date": ["2025-05-10", "2025-07-01"],
+            "duration_min": [60, 60], "amount": [20.0, 20.0],
+        }),
+    )
+    store = _store(tmp_path)
+    store.close_months("lessons", (2025, 7))
+    students = store.load("students")
+
+    with pytest.raises(ValueError, match="mesi chiusi"):
+        store.delete_cascade("students", students, students.index[students["id"] == "s1"][0])
+    assert list(store.load("students")["id"]) == ["s1", "s2"]
+
+    store.delete_cascade("students", students, students.index[students["id"] == "s2"][0])
+    assert list(store.load("students")["id"]) == ["s1"]
+    assert list(store.history("lessons")["id"]) == ["l1"]
+
+
+def test_delete_cascade_runs_load_migrations_without_deadlock(tmp_path):
+    # i pagamenti doppi si riscrivono al primo caricamento, qui dentro la cancellazione
+    _write_tables(
+        tmp_path,
+        students=pd.DataFrame({"id": ["s1"], "name": ["ANNA"], "hourly_rate": [20.0],
+                               "note": [""]}),
+        payments=pd.DataFrame({"student_id": ["s1", "s1"], "year": [2025, 2025],
+                               "month": [5, 5]}),
+    )
+    store = _store(tmp_path)
+    students = store.load("students")
+    worker = threading.Thread(
+        target=store.delete_cascade, args=("students", students, students.index[0]), daemon=True,
+    )
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    assert store.load("students").empty and store.load("payments").empty